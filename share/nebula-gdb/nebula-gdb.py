@@ -1,5 +1,15 @@
 import os
 
+# Add to Python module path
+module_dir = os.path.dirname(os.path.realpath(__file__)) + '/python'
+if not module_dir in sys.path:
+    sys.path.insert(0, module_dir)
+
+# Timings are reported by `nebula-gdb-startup', set NEBULA_GDB_PROFILE=1 to trace imports too.
+# `set nebula-gdb profile on' only exists once this file is sourced, so it
+# traces the deferred imports of lazy commands and printers, not startup.
+from profiler import phase, report
+
 # Apply basic GDB settings
 basics = [
     'set print demangle on',
@@ -16,30 +26,60 @@ basics = [
     'set history filename ' + os.environ['HOME'] + '/.gdb_history',
 ]
 
-for cmd in basics:
-    gdb.execute(cmd)
-
-# Add to Python module path
-module_dir = os.path.dirname(os.path.realpath(__file__)) + '/python'
-if not module_dir in sys.path:
-    sys.path.insert(0, module_dir)
+with phase('basics'):
+    for cmd in basics:
+        gdb.execute(cmd)
 
 # Install hook on object loading
-def new_objfile_handler(ev):
-    try:
-        if gdb.lookup_type('nebula') == None:
-            return
+def register_printers(progspace):
+    with phase('lookup nebula namespace'):
+        try:
+            if gdb.lookup_type('nebula') == None:
+                return False
+        except:
+            return False
 
-        if not 'libstdcxx.v6' in sys.modules:
+    if not 'libstdcxx.v6' in sys.modules:
+        with phase('build libstdc++ printers'):
+            import libstdcxx.v6.printers
+        with phase('register libstdc++ printers'):
             from libstdcxx.v6 import register_libstdcxx_printers
-            register_libstdcxx_printers(gdb.current_progspace())
+            register_libstdcxx_printers(progspace)
 
-        if not 'nebula.v3' in sys.modules:
+    if not 'nebula.v3' in sys.modules:
+        with phase('register nebula printers'):
             from nebula.v3 import register_nebula_printers
-            register_nebula_printers(gdb.current_progspace())
+            register_nebula_printers(progspace)
+
+    return True
+
+def new_objfile_handler(ev):
+    objfile = ev.new_objfile
+    progspace = objfile.progspace
+    # Nebula types live in the main executable or its separate debug file,
+    # so shared objects never need a lookup.
+    owner = getattr(objfile, 'owner', None) or objfile
+    if owner.filename != progspace.filename:
+        return
+    try:
+        if register_printers(progspace):
+            gdb.events.new_objfile.disconnect(new_objfile_handler)
     except:
         pass
 
-gdb.events.new_objfile.connect(new_objfile_handler)
+def register_current_progspace():
+    if gdb.current_progspace().filename is None:
+        return False
+    try:
+        return register_printers(gdb.current_progspace())
+    except:
+        return False
+
+if not register_current_progspace():
+    gdb.events.new_objfile.connect(new_objfile_handler)
+
+with phase('import rsp'):
+    import rsp
 
-import rsp
+if os.environ.get('NEBULA_GDB_PROFILE'):
+    print(report())
@@ -19,6 +19,7 @@ import gdb
 import itertools
 import re
 import sys
+from typecache import cached, scalar_format
 
 ### Python 2 + Python 3 compatibility code
 
@@ -82,7 +83,12 @@ except ImportError:
 # Starting with the type ORIG, search for the member type NAME.  This
 # handles searching upward through superclasses.  This is needed to
 # work around http://sourceware.org/bugzilla/show_bug.cgi?id=13615.
+# Results, including failures, are cached per progspace.
 def find_type(orig, name):
+    key = ('find_type', str(orig.strip_typedefs().unqualified()), name)
+    return cached(key, lambda: _find_type(orig, name))
+
+def _find_type(orig, name):
     typ = orig.strip_typedefs()
     while True:
         # Strip cv-qualifiers.  PR 67440.
@@ -138,6 +144,178 @@ def get_template_arg_list(type_obj):
             return template_args
         n += 1
 
+# Cap on the children yielded by the container printers: -1 (the default)
+# is unlimited, so MI front-ends can still fetch any range of children,
+# and 0 follows `print elements'.  Set with `set rsp-max-elements'.
+max_elements = -1
+
+def element_limit():
+    "Return the number of children a container printer may yield, or None"
+    if max_elements < 0:
+        return None
+    if max_elements > 0:
+        return max_elements
+    try:
+        limit = gdb.parameter('print elements')
+    except RuntimeError:
+        return None
+    if not limit:
+        return None
+    # One more than the limit, so that GDB still prints the ellipsis.
+    return limit + 1
+
+def limit_children(children, per_element = 1):
+    "Stop CHILDREN after element_limit() elements of PER_ELEMENT children each"
+    limit = element_limit()
+    if limit is None:
+        return children
+    return itertools.islice(children, limit * per_element)
+
+def read_raw(addr, size):
+    "Read bytes from the inferior, through the rsp page cache once it is loaded"
+    inferior = gdb.selected_inferior()
+    page_cache = getattr(gdb, 'page_cache', None)
+    if page_cache is not None:
+        return page_cache.read(inferior, addr, size)
+    return inferior.read_memory(addr, size).tobytes()
+
+def read_pointer(addr):
+    "Read a pointer from the inferior without creating a gdb.Value"
+    return int.from_bytes(read_raw(addr, 8), 'little')
+
+# Bytes of vector storage read at a time by the bulk path, so a capped
+# print of a huge vector only reads its head.
+bulk_chunk_size = 64 << 10
+
+def _bulk_format(type):
+    type = type.strip_typedefs()
+    fmt = scalar_format(type)
+    if fmt is not None:
+        # Only these print the same as a Python number; chars lose their
+        # character, floats are widened and narrower integers would be
+        # formatted as 8 bytes by print/x.
+        if type.code != gdb.TYPE_CODE_ENUM and fmt in ('q', 'Q', 'd', '?'):
+            return fmt
+        return ''
+    if type.code in (gdb.TYPE_CODE_CHAR, gdb.TYPE_CODE_ENUM, gdb.TYPE_CODE_PTR):
+        return ''
+    if type.code == gdb.TYPE_CODE_STRUCT:
+        # Aggregates of scalars are rebuilt from their bytes; anything else
+        # may have a printer that needs the element's address.
+        for field in type.fields():
+            if not hasattr(field, 'bitpos'):
+                continue
+            if field.is_base_class or _bulk_format(field.type) is None:
+                return None
+        return ''
+    return None
+
+def bulk_format(type):
+    """Return how elements of TYPE are decoded from raw memory: a memoryview
+    format for 8-byte integers, doubles and bools, '' to build gdb.Values
+    from the bytes, or None if they must be read one by one."""
+    return cached(('bulk_format', str(type.strip_typedefs())), lambda: _bulk_format(type))
+
+def bulk_children(elttype, addr, index, count):
+    "Yield COUNT children decoded from chunks of memory at ADDR, named from INDEX"
+    fmt = bulk_format(elttype)
+    size = elttype.sizeof
+    chunk = max(1, bulk_chunk_size // size)
+    inferior = gdb.selected_inferior()
+    for base in range(0, count, chunk):
+        n = min(chunk, count - base)
+        buf = memoryview(inferior.read_memory(addr + base * size, n * size))
+        if fmt:
+            for i, value in enumerate(buf.cast(fmt), index + base):
+                yield ('[%d]' % i, value)
+            continue
+        for i in range(n):
+            try:
+                value = gdb.Value(buf[i * size:(i + 1) * size], elttype)
+            except TypeError:
+                # GDB without gdb.Value(buffer, type), fall back to pointers.
+                ptr = gdb.Value(addr).cast(elttype.pointer())
+                for j in range(base + i, count):
+                    yield ('[%d]' % (index + j), ptr[j])
+                return
+            yield ('[%d]' % (index + base + i), value)
+
+# Bit containers are read as little-endian words, so bit N of the storage
+# is bit N % 8 of byte N / 8 whatever the word size.
+
+def read_words(addr, nwords, wordsize):
+    "Yield NWORDS unsigned words at ADDR, read in chunks"
+    fmt = {4: 'I', 8: 'Q'}[wordsize]
+    chunk = max(1, bulk_chunk_size // wordsize)
+    inferior = gdb.selected_inferior()
+    for base in range(0, nwords, chunk):
+        n = min(chunk, nwords - base)
+        for word in memoryview(inferior.read_memory(addr + base * wordsize, n * wordsize)).cast(fmt):
+            yield word
+
+def read_bits(addr, first, nbits):
+    "Return bits [FIRST, FIRST + NBITS) of the storage at ADDR as an int"
+    if nbits <= 0:
+        return 0
+    addr = addr + first // 8
+    first = first % 8
+    buf = gdb.selected_inferior().read_memory(addr, (first + nbits + 7) // 8)
+    return (int.from_bytes(buf, 'little') >> first) & ((1 << nbits) - 1)
+
+def popcount(addr, first, nbits):
+    "Count the set bits in [FIRST, FIRST + NBITS) of the storage at ADDR"
+    total = 0
+    step = 8 * bulk_chunk_size
+    for base in range(first, first + nbits, step):
+        total = total + bin(read_bits(addr, base, min(step, first + nbits - base))).count('1')
+    return total
+
+def bit_runs(words, first, nbits, width):
+    """Yield (start, stop, bit) for the runs of equal bits in [FIRST, FIRST + NBITS)
+    of WORDS, which are WIDTH bits wide.  Positions are relative to FIRST."""
+    ones = (1 << width) - 1
+    start, bit = 0, None
+    pos = -first
+    for word in words:
+        if pos >= nbits:
+            break
+        lo = max(0, -pos)
+        hi = min(width, nbits - pos)
+        if lo == 0 and hi == width and (word == 0 or word == ones):
+            # Whole words of zeros or ones only extend or start a run.
+            b = word & 1
+            if b != bit:
+                if bit is not None:
+                    yield start, pos, bit
+                start, bit = pos, b
+            pos = pos + width
+            continue
+        i = lo
+        word = word >> lo
+        while i < hi:
+            b = word & 1
+            if b:
+                n = (word ^ (word + 1)).bit_length() - 1
+            elif word:
+                n = (word & -word).bit_length() - 1
+            else:
+                n = hi - i
+            n = min(n, hi - i)
+            if b != bit:
+                if bit is not None:
+                    yield start, pos + i, bit
+                start, bit = pos + i, b
+            word = word >> n
+            i = i + n
+        pos = pos + width
+    if bit is not None:
+        yield start, min(pos, nbits), bit
+
+def run_name(start, stop):
+    if stop - start == 1:
+        return '[%d]' % start
+    return '[%d..%d]' % (start, stop - 1)
+
 class SmartPtrIterator(Iterator):
     "An iterator for smart pointer types with a single 'child' value"
 
@@ -328,18 +506,9 @@ class StdVectorPrinter:
     "Print a std::vector"
 
     class _iterator(Iterator):
-        def __init__ (self, start, finish, bitvec):
-            self.bitvec = bitvec
-            if bitvec:
-                self.item   = start['_M_p']
-                self.so     = start['_M_offset']
-                self.finish = finish['_M_p']
-                self.fo     = finish['_M_offset']
-                itype = self.item.dereference().type
-                self.isize = 8 * itype.sizeof
-            else:
-                self.item = start
-                self.finish = finish
+        def __init__ (self, start, finish):
+            self.item = start
+            self.finish = finish
             self.count = 0
 
         def __iter__(self):
@@ -348,56 +517,79 @@ class StdVectorPrinter:
         def __next__(self):
             count = self.count
             self.count = self.count + 1
-            if self.bitvec:
-                if self.item == self.finish and self.so >= self.fo:
-                    raise StopIteration
-                elt = self.item.dereference()
-                if elt & (1 << self.so):
-                    obit = 1
-                else:
-                    obit = 0
-                self.so = self.so + 1
-                if self.so >= self.isize:
-                    self.item = self.item + 1
-                    self.so = 0
-                return ('[%d]' % count, obit)
-            else:
-                if self.item == self.finish:
-                    raise StopIteration
-                elt = self.item.dereference()
-                self.item = self.item + 1
-                return ('[%d]' % count, elt)
+            if self.item == self.finish:
+                raise StopIteration
+            elt = self.item.dereference()
+            self.item = self.item + 1
+            return ('[%d]' % count, elt)
 
     def __init__(self, typename, val):
         self.typename = strip_versioned_namespace(typename)
         self.val = val
-        self.is_bool = val.type.template_argument(0).code  == gdb.TYPE_CODE_BOOL
+        self.elttype = val.type.template_argument(0)
+        self.is_bool = self.elttype.code  == gdb.TYPE_CODE_BOOL
+        self.bulk = not self.is_bool and bulk_format(self.elttype) is not None
 
     def children(self):
-        return self._iterator(self.val['_M_impl']['_M_start'],
-                              self.val['_M_impl']['_M_finish'],
-                              self.is_bool)
+        if self.is_bool:
+            # Runs of equal bits, e.g. [0..4095] = 1.
+            start = self.val['_M_impl']['_M_start']
+            words = start['_M_p']
+            width = 8 * words.dereference().type.sizeof
+            so = int(start['_M_offset'])
+            length = self.length()
+            words = read_words(int(words), (so + length + width - 1) // width, width // 8)
+            return limit_children((run_name(a, b), bit)
+                                  for a, b, bit in bit_runs(words, so, length, width))
+        if self.bulk:
+            start = int(self.val['_M_impl']['_M_start'])
+            return limit_children(bulk_children(self.elttype, start, 0, self.length()))
+        return limit_children(self._iterator(self.val['_M_impl']['_M_start'],
+                                             self.val['_M_impl']['_M_finish']))
+
+    def length(self):
+        start = self.val['_M_impl']['_M_start']
+        finish = self.val['_M_impl']['_M_finish']
+        if self.is_bool:
+            so = start['_M_offset']
+            fo = finish['_M_offset']
+            start = start['_M_p']
+            finish = finish['_M_p']
+            bl = 8 * start.dereference().type.sizeof
+            return int((bl - so) + bl * ((finish - start) - 1) + fo)
+        return int(finish - start)
+
+    def slice(self, start, count):
+        "Return the children [START, START + COUNT) without visiting the others"
+        stop = min(self.length(), start + count)
+        first = self.val['_M_impl']['_M_start']
+        if self.is_bool:
+            bits = read_bits(int(first['_M_p']), int(first['_M_offset']) + start, stop - start)
+            return (('[%d]' % i, (bits >> (i - start)) & 1) for i in range(start, stop))
+        if self.bulk:
+            addr = int(first) + start * self.elttype.sizeof
+            return bulk_children(self.elttype, addr, start, max(0, stop - start))
+        return (('[%d]' % i, first[i]) for i in range(start, stop))
 
     def to_string(self):
         start = self.val['_M_impl']['_M_start']
-        finish = self.val['_M_impl']['_M_finish']
         end = self.val['_M_impl']['_M_end_of_storage']
         if self.is_bool:
-            start = self.val['_M_impl']['_M_start']['_M_p']
-            so    = self.val['_M_impl']['_M_start']['_M_offset']
-            finish = self.val['_M_impl']['_M_finish']['_M_p']
-            fo     = self.val['_M_impl']['_M_finish']['_M_offset']
-            itype = start.dereference().type
-            bl = 8 * itype.sizeof
-            length   = (bl - so) + bl * ((finish - start) - 1) + fo
+            start = start['_M_p']
+            bl = 8 * start.dereference().type.sizeof
             capacity = bl * (end - start)
-            return ('%s<bool> of length %d, capacity %d'
-                    % (self.typename, int (length), int (capacity)))
+            so = int(self.val['_M_impl']['_M_start']['_M_offset'])
+            length = self.length()
+            return ('%s<bool> of length %d, capacity %d, %d set'
+                    % (self.typename, length, int (capacity), popcount(int(start), so, length)))
         else:
             return ('%s of length %d, capacity %d'
-                    % (self.typename, int (finish - start), int (end - start)))
+                    % (self.typename, self.length(), int (end - start)))
 
     def display_hint(self):
+        # Bits are printed as named runs, which an array would hide.
+        if self.is_bool:
+            return None
         return 'array'
 
 class StdVectorIteratorPrinter:
@@ -519,9 +711,13 @@ class RbtreeIterator(Iterator):
     """
 
     def __init__(self, rbtree):
-        self.size = rbtree['_M_t']['_M_impl']['_M_node_count']
-        self.node = rbtree['_M_t']['_M_impl']['_M_header']['_M_left']
+        impl = rbtree['_M_t']['_M_impl']
+        self.size = impl['_M_node_count']
+        self.node = impl['_M_header']['_M_left']
         self.count = 0
+        # Nodes come from an in-order walk of the raw node headers, only
+        # the returned pointers are built as gdb.Values.
+        self.nodes = rbtree_walk(int(impl['_M_header']['_M_parent']), int(self.size))
 
     def __iter__(self):
         return self
@@ -529,27 +725,51 @@ class RbtreeIterator(Iterator):
     def __len__(self):
         return int (self.size)
 
+    def skip(self, n):
+        "Advance N nodes without building any gdb.Value"
+        n = min(n, int(self.size) - self.count)
+        if n > 0:
+            self.count = self.count + sum(1 for _ in itertools.islice(self.nodes, n))
+        return self
+
     def __next__(self):
         if self.count == self.size:
             raise StopIteration
-        result = self.node
+        node, depth = next(self.nodes)
         self.count = self.count + 1
-        if self.count < self.size:
-            # Compute the next node.
-            node = self.node
-            if node.dereference()['_M_right']:
-                node = node.dereference()['_M_right']
-                while node.dereference()['_M_left']:
-                    node = node.dereference()['_M_left']
-            else:
-                parent = node.dereference()['_M_parent']
-                while node == parent.dereference()['_M_right']:
-                    node = parent
-                    parent = parent.dereference()['_M_parent']
-                if node.dereference()['_M_right'] != parent:
-                    node = parent
-            self.node = node
-        return result
+        return gdb.Value(node).cast(self.node.type)
+
+def rbtree_walk(root, count):
+    """Yield (address, depth) of at most COUNT nodes of the rb-tree at ROOT in
+    order, reading each node header once and keeping the path on a stack"""
+    parent, left, right = rbtree_layout()
+    size = max(left, right) + 8
+    stack = []
+    node, depth = root, 1
+    while count > 0:
+        while node:
+            header = read_raw(node, size)
+            stack.append((node, int.from_bytes(header[right:right + 8], 'little'), depth))
+            node = int.from_bytes(header[left:left + 8], 'little')
+            depth = depth + 1
+        if len(stack) == 0:
+            return
+        node, child, depth = stack.pop()
+        yield node, depth
+        count = count - 1
+        node, depth = child, depth + 1
+
+def rbtree_layout():
+    "Return the offsets of _M_parent, _M_left and _M_right in _Rb_tree_node_base"
+    def compute():
+        try:
+            base = gdb.lookup_type('std::_Rb_tree_node_base')
+        except RuntimeError:
+            # _M_color, padded to a pointer, precedes the links.
+            return 8, 16, 24
+        offsets = dict((f.name, f.bitpos // 8) for f in base.fields())
+        return offsets['_M_parent'], offsets['_M_left'], offsets['_M_right']
+    return cached('rbtree_layout', compute)
 
 def get_value_from_Rb_tree_node(node):
     """Returns the value held in an _Rb_tree_node<_Val>"""
@@ -647,7 +867,15 @@ class StdMapPrinter:
         rep_type = find_type(self.val.type, '_Rep_type')
         node = find_type(rep_type, '_Link_type')
         node = node.strip_typedefs()
-        return self._iter (RbtreeIterator (self.val), node)
+        return limit_children(self._iter (RbtreeIterator (self.val), node), 2)
+
+    def slice (self, start, count):
+        rep_type = find_type(self.val.type, '_Rep_type')
+        node = find_type(rep_type, '_Link_type')
+        node = node.strip_typedefs()
+        it = self._iter (RbtreeIterator (self.val).skip(start), node)
+        it.count = 2 * start
+        return itertools.islice(it, 2 * count)
 
     def display_hint (self):
         return 'map'
@@ -687,7 +915,15 @@ class StdSetPrinter:
         rep_type = find_type(self.val.type, '_Rep_type')
         node = find_type(rep_type, '_Link_type')
         node = node.strip_typedefs()
-        return self._iter (RbtreeIterator (self.val), node)
+        return limit_children(self._iter (RbtreeIterator (self.val), node))
+
+    def slice (self, start, count):
+        rep_type = find_type(self.val.type, '_Rep_type')
+        node = find_type(rep_type, '_Link_type')
+        node = node.strip_typedefs()
+        it = self._iter (RbtreeIterator (self.val).skip(start), node)
+        it.count = start
+        return itertools.islice(it, count)
 
 class StdBitsetPrinter:
     "Print a std::bitset"
@@ -696,77 +932,56 @@ class StdBitsetPrinter:
         self.typename = strip_versioned_namespace(typename)
         self.val = val
 
-    def to_string (self):
-        # If template_argument handled values, we could print the
-        # size.  Or we could use a regexp on the type.
-        return '%s' % (self.typename)
-
-    def children (self):
+    def words (self):
+        "Return (words, number of words, word size) of the bitset, or None"
         try:
             # An empty bitset may not have any members which will
             # result in an exception being thrown.
             words = self.val['_M_w']
         except:
-            return []
+            return None
 
         wtype = words.type
 
         # The _M_w member can be either an unsigned long, or an
         # array.  This depends on the template specialization used.
-        # If it is a single long, convert to a single element list.
         if wtype.code == gdb.TYPE_CODE_ARRAY:
             tsize = wtype.target ().sizeof
         else:
-            words = [words]
             tsize = wtype.sizeof
+        nwords = wtype.sizeof // tsize
 
-        nwords = wtype.sizeof / tsize
-        result = []
-        byte = 0
-        while byte < nwords:
-            w = words[byte]
-            bit = 0
-            while w != 0:
-                if (w & 1) != 0:
-                    # Another spot where we could use 'set'?
-                    result.append(('[%d]' % (byte * tsize * 8 + bit), 1))
-                bit = bit + 1
-                w = w >> 1
-            byte = byte + 1
-        return result
-
-class StdDequePrinter:
-    "Print a std::deque"
+        if words.address is not None:
+            return read_words(int(words.address), nwords, tsize), nwords, tsize
+        if wtype.code != gdb.TYPE_CODE_ARRAY:
+            return [int(words)], nwords, tsize
+        return [int(words[i]) for i in range(nwords)], nwords, tsize
 
-    class _iter(Iterator):
-        def __init__(self, node, start, end, last, buffer_size):
-            self.node = node
-            self.p = start
-            self.end = end
-            self.last = last
-            self.buffer_size = buffer_size
-            self.count = 0
-
-        def __iter__(self):
-            return self
-
-        def __next__(self):
-            if self.p == self.last:
-                raise StopIteration
+    def size (self, nwords, tsize):
+        try:
+            return int(self.val.type.strip_typedefs().template_argument(0))
+        except:
+            return nwords * tsize * 8
 
-            result = ('[%d]' % self.count, self.p.dereference())
-            self.count = self.count + 1
+    def to_string (self):
+        words = self.words()
+        if words is None:
+            return '%s' % (self.typename)
+        words, nwords, tsize = words
+        count = sum(bin(w).count('1') for w in words)
+        return '%s with %d of %d bits set' % (self.typename, count, self.size(nwords, tsize))
 
-            # Advance the 'cur' pointer.
-            self.p = self.p + 1
-            if self.p == self.end:
-                # If we got to the end of this bucket, move to the
-                # next bucket.
-                self.node = self.node + 1
-                self.p = self.node[0]
-                self.end = self.p + self.buffer_size
+    def children (self):
+        words = self.words()
+        if words is None:
+            return []
+        words, nwords, tsize = words
+        # Only the runs of set bits are shown, e.g. [0..4095] = 1.
+        runs = bit_runs(words, 0, self.size(nwords, tsize), tsize * 8)
+        return limit_children((run_name(a, b), 1) for a, b, bit in runs if bit)
 
-            return result
+class StdDequePrinter:
+    "Print a std::deque"
 
     def __init__(self, typename, val):
         self.typename = strip_versioned_namespace(typename)
@@ -778,7 +993,7 @@ class StdDequePrinter:
         else:
             self.buffer_size = 1
 
-    def to_string(self):
+    def length(self):
         start = self.val['_M_impl']['_M_start']
         end = self.val['_M_impl']['_M_finish']
 
@@ -786,15 +1001,44 @@ class StdDequePrinter:
         delta_s = start['_M_last'] - start['_M_cur']
         delta_e = end['_M_cur'] - end['_M_first']
 
-        size = self.buffer_size * delta_n + delta_s + delta_e
+        return long(self.buffer_size * delta_n + delta_s + delta_e)
 
-        return '%s with %s' % (self.typename, num_elements(long(size)))
+    def to_string(self):
+        return '%s with %s' % (self.typename, num_elements(self.length()))
 
     def children(self):
-        start = self.val['_M_impl']['_M_start']
-        end = self.val['_M_impl']['_M_finish']
-        return self._iter(start['_M_node'], start['_M_cur'], start['_M_last'],
-                          end['_M_cur'], self.buffer_size)
+        return limit_children(self.window(0, self.length()))
+
+    def slice(self, start, count):
+        "Return the children [START, START + COUNT), locating each by its block"
+        return self.window(start, min(self.length(), start + count))
+
+    def window(self, start, stop):
+        """Yield the children [START, STOP), reading the used part of the map
+        once and each block with a single read"""
+        if start >= stop:
+            return
+        first = self.val['_M_impl']['_M_start']
+        offset = long(first['_M_cur'] - first['_M_first'])
+        bs = self.buffer_size
+        size = self.elttype.sizeof
+        lo_block = (offset + start) // bs
+        hi_block = (offset + stop - 1) // bs
+        node = int(first['_M_node'])
+        blocks = memoryview(read_raw(node + 8 * lo_block, 8 * (hi_block - lo_block + 1))).cast('Q')
+        bulk = bulk_format(self.elttype) is not None
+        index = start
+        for k, block in enumerate(blocks, lo_block):
+            lo = max(offset + start - k * bs, 0)
+            hi = min(offset + stop - k * bs, bs)
+            if bulk:
+                for child in bulk_children(self.elttype, block + lo * size, index, hi - lo):
+                    yield child
+            else:
+                base = gdb.Value(block).cast(self.elttype.pointer())
+                for j in range(lo, hi):
+                    yield ('[%d]' % (index + j - lo), base[j])
+            index = index + hi - lo
 
     def display_hint (self):
         return 'array'
@@ -874,22 +1118,33 @@ class Tr1HashtableIterator(Iterator):
                 self.bucket = self.bucket + 1
         return result
 
+def hashtable_walk(node, count):
+    """Yield the addresses of at most COUNT hashtable nodes from NODE, following
+    the raw _M_nxt links, which are the first member of every node"""
+    while node and count > 0:
+        yield node
+        node = read_pointer(node)
+        count = count - 1
+
 class StdHashtableIterator(Iterator):
-    def __init__(self, hash):
-        self.node = hash['_M_before_begin']['_M_nxt']
+    def __init__(self, hash, skip = 0):
         self.node_type = find_type(hash.type, '__node_type').pointer()
+        # The value offset comes from a node at address 0, which is never read.
+        elt = gdb.Value(0).cast(self.node_type).dereference()
+        self.offset = int(elt['_M_storage'].address)
+        self.value_type = elt.type.strip_typedefs().template_argument(0).pointer()
+        self.nodes = hashtable_walk(int(hash['_M_before_begin']['_M_nxt']),
+                                    int(hash['_M_element_count']))
+        if skip > 0:
+            for _ in itertools.islice(self.nodes, skip):
+                pass
 
     def __iter__(self):
         return self
 
     def __next__(self):
-        if self.node == 0:
-            raise StopIteration
-        elt = self.node.cast(self.node_type).dereference()
-        self.node = elt['_M_nxt']
-        valptr = elt['_M_storage'].address
-        valptr = valptr.cast(elt.type.template_argument(0).pointer())
-        return valptr.dereference()
+        node = next(self.nodes)
+        return gdb.Value(node + self.offset).cast(self.value_type).dereference()
 
 class Tr1UnorderedSetPrinter:
     "Print a tr1::unordered_set"
@@ -914,8 +1169,16 @@ class Tr1UnorderedSetPrinter:
     def children (self):
         counter = imap (self.format_count, itertools.count())
         if self.typename.startswith('std::tr1'):
-            return izip (counter, Tr1HashtableIterator (self.hashtable()))
-        return izip (counter, StdHashtableIterator (self.hashtable()))
+            return limit_children(izip (counter, Tr1HashtableIterator (self.hashtable())))
+        return limit_children(izip (counter, StdHashtableIterator (self.hashtable())))
+
+    def slice (self, start, count):
+        counter = imap (self.format_count, itertools.count(start))
+        if self.typename.startswith('std::tr1'):
+            data = itertools.islice(Tr1HashtableIterator (self.hashtable()), start, None)
+        else:
+            data = StdHashtableIterator (self.hashtable(), start)
+        return itertools.islice(izip (counter, data), count)
 
 class Tr1UnorderedMapPrinter:
     "Print a tr1::unordered_map"
@@ -953,9 +1216,18 @@ class Tr1UnorderedMapPrinter:
         if self.typename.startswith('std::tr1'):
             data = self.flatten (imap (self.format_one, Tr1HashtableIterator (self.hashtable())))
             # Zip the two iterators together.
-            return izip (counter, data)
+            return limit_children(izip (counter, data), 2)
         data = self.flatten (imap (self.format_one, StdHashtableIterator (self.hashtable())))
         # Zip the two iterators together.
+        return limit_children(izip (counter, data), 2)
+
+    def slice (self, start, count):
+        counter = imap (self.format_count, itertools.count(2 * start))
+        if self.typename.startswith('std::tr1'):
+            data = itertools.islice(Tr1HashtableIterator (self.hashtable()), start, None)
+        else:
+            data = StdHashtableIterator (self.hashtable(), start)
+        data = self.flatten (imap (self.format_one, itertools.islice(data, count)))
         return izip (counter, data)
 
     def display_hint (self):
@@ -1381,13 +1653,30 @@ class RxPrinter(object):
 # A pretty-printer that conforms to the "PrettyPrinter" protocol from
 # gdb.printing.  It can also be used directly as an old-style printer.
 class Printer(object):
-    def __init__(self, name):
+    def __init__(self, name, build = None):
         super(Printer, self).__init__()
         self.name = name
-        self.subprinters = []
-        self.lookup = {}
+        self._subprinters = []
+        self._lookup = {}
         self.enabled = True
         self.compiled_rx = re.compile('^([a-zA-Z0-9_:]+)(<.*>)?$')
+        # Called with this printer to add the subprinters on first use.
+        self.build = build
+
+    def _build(self):
+        if self.build is not None:
+            build, self.build = self.build, None
+            build(self)
+
+    @property
+    def subprinters(self):
+        self._build()
+        return self._subprinters
+
+    @property
+    def lookup(self):
+        self._build()
+        return self._lookup
 
     def add(self, name, function):
         # A small sanity check.
@@ -1395,8 +1684,8 @@ class Printer(object):
         if not self.compiled_rx.match(name):
             raise ValueError('libstdc++ programming error: "%s" does not match' % name)
         printer = RxPrinter(name, function)
-        self.subprinters.append(printer)
-        self.lookup[name] = printer
+        self._subprinters.append(printer)
+        self._lookup[name] = printer
 
     # Add a name using _GLIBCXX_BEGIN_NAMESPACE_VERSION.
     def add_version(self, base, name, function):
@@ -1633,12 +1922,49 @@ def add_one_type_printer(obj, match, name):
         printer = FilteringTypePrinter(ns + match, ns + name)
         gdb.types.register_type_printer(obj, printer)
 
+class LazyTypePrinter(object):
+    r"""
+    A type printer that stands for all the libstdc++ type printers.
+
+    The individual type printers are only created the first time GDB
+    asks for type recognizers, e.g. by 'ptype' or 'whatis'.  They are
+    then registered on the same locus in place of this one, so that
+    'info type-printers' and 'disable type-printer' see each of them.
+    """
+
+    def __init__(self, locus):
+        self.name = 'libstdc++-v6'
+        self.enabled = True
+        self.locus = locus
+        self.type_printers = None
+
+    def instantiate(self):
+        "Register the type printers after this one, which GDB visits next."
+        if self.type_printers is None:
+            self.type_printers = []
+            # Registering with self as the locus fills self.type_printers.
+            add_type_printers(self)
+            printers = self.locus.type_printers
+            index = printers.index(self)
+            printers[index + 1:index + 1] = self.type_printers
+            # GDB is iterating over the list, so the stub leaves it later.
+            gdb.post_event(self.unregister)
+        return None
+
+    def unregister(self):
+        if self in self.locus.type_printers:
+            self.locus.type_printers.remove(self)
+
 def register_type_printers(obj):
     global _use_type_printing
 
     if not _use_type_printing:
         return
 
+    printer = LazyTypePrinter(gdb if obj is None else obj)
+    gdb.types.register_type_printer(obj, printer)
+
+def add_type_printers(obj):
     # Add type printers for typedefs std::string, std::wstring etc.
     for ch in ('', 'w', 'u8', 'u16', 'u32'):
         add_one_type_printer(obj, 'basic_string', ch + 'string')
@@ -1747,8 +2073,9 @@ def register_libstdcxx_printers (obj):
 def build_libstdcxx_dictionary ():
     global libstdcxx_printer
 
-    libstdcxx_printer = Printer("libstdc++-v6")
+    libstdcxx_printer = Printer("libstdc++-v6", add_libstdcxx_printers)
 
+def add_libstdcxx_printers (libstdcxx_printer):
     # libstdc++ objects requiring pretty-printing.
     # In order from:
     # http://gcc.gnu.org/onlinedocs/libstdc++/latest-doxygen/a01847.html
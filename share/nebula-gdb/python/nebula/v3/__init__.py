@@ -3,3 +3,6 @@ import gdb
 def register_nebula_printers(obj):
     from .printers import build_nebula_printers
     gdb.printing.register_pretty_printer(obj, build_nebula_printers())
+    from rsp import lazy_command
+    lazy_command('nebula-value-stats', 'nebula.v3.commands',
+                 'Show a histogram of the Value types in a nebula::DataSet, List or std::vector<nebula::Value>')
@@ -0,0 +1,147 @@
+import gdb
+import heapq
+import struct
+import rsp
+from typecache import lookup_type
+from nebula.v3.values import *
+
+def field_offset(typename, name):
+    for field in lookup_type(typename).strip_typedefs().fields():
+        if field.name == name:
+            return field.bitpos // 8
+    raise ValueError(f'{typename} has no member {name}')
+
+def vector_range(addr):
+    start, finish = rsp.x(addr, 'Q', 2)
+    return start, finish
+
+def hashtable_size(addr):
+    # _M_buckets, _M_bucket_count, _M_before_begin, _M_element_count
+    return rsp.x(addr + 24, 'Q')[0]
+
+
+class ValueStats:
+    def __init__(self, layout, top):
+        self.layout = layout
+        self.top = top
+        self.count = 0
+        self.types = {}
+        # Value::Type -> [count, total size, max size], sizes of strings and containers
+        self.sizes = {}
+        self.largest = []
+        self.list_values = field_offset('nebula::List', 'values')
+        self.set_values = field_offset('nebula::Set', 'values')
+        self.map_kvs = field_offset('nebula::Map', 'kvs')
+        self.dataset_rows = field_offset('nebula::DataSet', 'rows')
+        self.row_size = lookup_type('nebula::Row').strip_typedefs().sizeof
+        self.row_values = field_offset('nebula::Row', 'values')
+
+    def size_of(self, tag, ptr):
+        '''Return (number of elements or bytes, approximate bytes) of a heap variant'''
+        if tag == kString:
+            # std::string: _M_p, _M_string_length
+            n = rsp.x(ptr + 8, 'Q')[0]
+            return n, n
+        if tag == kList:
+            start, finish = vector_range(ptr + self.list_values)
+            return (finish - start) // self.layout.size, finish - start
+        if tag == kSet:
+            n = hashtable_size(ptr + self.set_values)
+            return n, n * self.layout.size
+        if tag == kMap:
+            n = hashtable_size(ptr + self.map_kvs)
+            return n, n * self.layout.size
+        if tag == kDataSet:
+            start, finish = vector_range(ptr + self.dataset_rows)
+            return (finish - start) // self.row_size, finish - start
+        return None
+
+    def add_values(self, addr, count, label):
+        offset = self.layout.value_offset
+        for i, (tag, value, raw) in enumerate(self.layout.decode(addr, count)):
+            self.count = self.count + 1
+            self.types[tag] = self.types.get(tag, 0) + 1
+            if tag not in (kString, kList, kSet, kMap, kDataSet):
+                continue
+            ptr = int.from_bytes(raw[offset:offset + 8], 'little')
+            try:
+                n, nbytes = self.size_of(tag, ptr)
+            except ValueError:
+                continue
+            stat = self.sizes.setdefault(tag, [0, 0, 0])
+            stat[0] = stat[0] + 1
+            stat[1] = stat[1] + n
+            stat[2] = max(stat[2], n)
+            item = (nbytes, label(i), tag, n)
+            if len(self.largest) < self.top:
+                heapq.heappush(self.largest, item)
+            elif item > self.largest[0]:
+                heapq.heapreplace(self.largest, item)
+
+    def add_vector(self, addr, label):
+        start, finish = vector_range(addr)
+        self.add_values(start, (finish - start) // self.layout.size, label)
+
+    def add_dataset(self, addr):
+        start, finish = vector_range(addr + self.dataset_rows)
+        rows = rsp.read(start, finish - start)
+        for r in range(len(rows) // self.row_size):
+            values, end = struct.unpack_from('<QQ', rows, r * self.row_size + self.row_values)
+            self.add_values(values, (end - values) // self.layout.size, lambda i, r = r: f'[{r}][{i}]')
+
+    def report(self):
+        print(f'{self.count} values, {self.layout.size} bytes each')
+        if self.count == 0:
+            return
+        for tag, n in sorted(self.types.items(), key = lambda t: -t[1]):
+            name = type_names.get(tag, f'{tag:#x}')
+            print(f'  {name:<12} {n:>12} {n * 100.0 / self.count:6.2f}%')
+        for tag, (n, total, largest) in sorted(self.sizes.items()):
+            unit = 'bytes' if tag == kString else 'elements'
+            print(f'{type_names[tag]}: {n}, {unit} total: {total}, avg: {total // n}, max: {largest}')
+        if len(self.largest) != 0:
+            print(f'top {len(self.largest)} largest (approximate bytes):')
+            for nbytes, label, tag, n in sorted(self.largest, reverse = True):
+                unit = 'bytes' if tag == kString else 'elements'
+                print(f'  {label:<16} {type_names[tag]:<10} {n} {unit}, ~{nbytes} bytes')
+
+
+class ValueStatsCommand(gdb.Command):
+    '''Show a histogram of the Value types in a nebula::DataSet, List or std::vector<nebula::Value>'''
+    def __init__(self):
+        super(ValueStatsCommand, self).__init__('nebula-value-stats', gdb.COMMAND_USER)
+
+    def invoke(self, args, is_tty):
+        try:
+            self.run(args)
+        except Exception as e:
+            print(e)
+
+    def run(self, args):
+        args = gdb.string_to_argv(args)
+        if len(args) not in (1, 2):
+            print('nebula-value-stats <expr> [top-N]')
+            return
+        top = int(args[1]) if len(args) == 2 else 10
+        value = gdb.parse_and_eval(args[0])
+        if value.type.code == gdb.TYPE_CODE_REF:
+            value = value.referenced_value()
+        if value.type.strip_typedefs().code == gdb.TYPE_CODE_PTR:
+            value = value.dereference()
+        addr = int(value.address)
+        tag = value.type.strip_typedefs().unqualified().tag or ''
+        stats = ValueStats(value_layout(), top)
+        if tag == 'nebula::DataSet':
+            stats.add_dataset(addr)
+        elif tag == 'nebula::List' or tag == 'nebula::Row':
+            stats.add_vector(addr + field_offset(tag, 'values'), lambda i: f'[{i}]')
+        elif tag == 'nebula::Value':
+            stats.add_values(addr, 1, lambda i: 'value')
+        elif tag.startswith('std::vector<nebula::Value,') or tag.startswith('std::__debug::vector<nebula::Value,'):
+            stats.add_vector(addr, lambda i: f'[{i}]')
+        else:
+            print(f"'{args[0]}' is not a nebula::DataSet, List, Row or std::vector<nebula::Value>")
+            return
+        stats.report()
+
+ValueStatsCommand()
@@ -1,4 +1,7 @@
 import gdb
+from typecache import lookup_type
+from libstdcxx.v6.printers import limit_children
+from nebula.v3.values import *
 
 class NebulaPrinter:
     def get_from_unique_ptr(self, ptr):
@@ -6,6 +9,51 @@ class NebulaPrinter:
     def deref_from_unique_ptr(self, ptr):
         pointer = self.get_from_unique_ptr(ptr)
         return pointer.dereference()
+    def deref(self, ptr):
+        # Some variants are held by a raw pointer rather than a unique_ptr.
+        if ptr.type.strip_typedefs().code == gdb.TYPE_CODE_PTR:
+            return ptr.dereference()
+        return self.deref_from_unique_ptr(ptr)
+    def short_string(self, value):
+        return str(value).replace('\n', ' ')
+    def vector_size(self, vec):
+        return int(vec['_M_impl']['_M_finish'] - vec['_M_impl']['_M_start'])
+    def hashtable_size(self, table):
+        return int(table['_M_h']['_M_element_count'])
+    def container_children(self, container):
+        # Children of the libstdc++ printer are generated on demand.
+        visualizer = gdb.default_visualizer(container)
+        if visualizer is None or not hasattr(visualizer, 'children'):
+            return iter([('[contained value]', container)])
+        return visualizer.children()
+    def value_children(self, vec):
+        # Decode std::vector<nebula::Value> from one bulk read if the layout is known.
+        try:
+            layout = value_layout()
+        except:
+            return self.container_children(vec)
+        return limit_children(self._value_children(layout, vec, 0, self.vector_size(vec)))
+    def value_slice(self, vec, start, count):
+        count = max(0, min(self.vector_size(vec), start + count) - start)
+        try:
+            layout = value_layout()
+        except:
+            first = vec['_M_impl']['_M_start']
+            return (('[%d]' % i, first[i]) for i in range(start, start + count))
+        return self._value_children(layout, vec, start, count)
+    def _value_children(self, layout, vec, start, count):
+        first = int(vec['_M_impl']['_M_start'])
+        decoded = layout.decode(first + start * layout.size, count)
+        for i, (tag, value, raw) in enumerate(decoded, start):
+            if tag in (kBool, kInt, kFloat) and value is not None:
+                yield ('[%d]' % i, value)
+                continue
+            child = None
+            if tag == kEmpty or value is not None:
+                child = layout.from_bytes(raw)
+            if child is None:
+                child = layout.value_at(first + i * layout.size)
+            yield ('[%d]' % i, child)
 
 class StatusPrinter(NebulaPrinter):
     def __init__(self, value):
@@ -15,9 +63,9 @@ class StatusPrinter(NebulaPrinter):
         base_ptr = self.get_from_unique_ptr(self.value['state_'])
         if base_ptr == 0:
             return "OK"
-        size_ptr = base_ptr.cast(gdb.lookup_type('uint16_t').pointer())
-        code_ptr = (base_ptr + 2).cast(gdb.lookup_type('nebula::Status::Code').pointer())
-        msg_ptr = (base_ptr + 4).cast(gdb.lookup_type('char').pointer())
+        size_ptr = base_ptr.cast(lookup_type('uint16_t').pointer())
+        code_ptr = (base_ptr + 2).cast(lookup_type('nebula::Status::Code').pointer())
+        msg_ptr = (base_ptr + 4).cast(lookup_type('char').pointer())
         result = "Status = {\n  code = %s,\n  msg  = \"%s\"\n}" % (str(code_ptr.dereference()), msg_ptr.string(length = size_ptr.dereference()))
         return result;
 
@@ -35,27 +83,22 @@ class StatusOrPrinter(NebulaPrinter):
             return str(self.value['variant_']['value_'])
 
 class NullPrinter(NebulaPrinter):
+    names = {
+        0: "kNullValue",
+        1: "kNullNaN",
+        2: "kNullBadData",
+        3: "kNullBadType",
+        4: "kNullOverflow",
+        5: "kNullUnknownProp",
+        6: "kNullDivByZero",
+        7: "kNullOutOfRange",
+    }
+
     def __init__(self, value):
         self.value = value
 
     def to_string(self):
-        if self.value == 0:
-            return "kNullValue"
-        if self.value == 1:
-            return "kNullNaN"
-        if self.value == 2:
-            return "kNullBadData"
-        if self.value == 3:
-            return "kNullBadType"
-        if self.value == 4:
-            return "kNullOverflow"
-        if self.value == 5:
-            return "kNullUnknownProp"
-        if self.value == 6:
-            return "kNullDivByZero"
-        if self.value == 7:
-            return "kNullOutOfRange"
-        return "unknown"
+        return self.names.get(int(self.value), "unknown")
 
 class DatePrinter(NebulaPrinter):
     def __init__(self, value):
@@ -82,47 +125,257 @@ class DateTimePrinter(NebulaPrinter):
         return "%04d-%02d-%02d %02d:%02d:%02d.%06d" % (v['year'], v['month'], v['day'], v['hour'], v['minute'], v['sec'], v['microsec'])
 
 class ValuePrinter(NebulaPrinter):
+    # Value::Type -> (member of value_, whether it is held by a unique_ptr)
+    fields = {
+        (1<<1):  ('bVal', False),
+        (1<<2):  ('iVal', False),
+        (1<<3):  ('fVal', False),
+        (1<<4):  ('sVal', True),
+        (1<<5):  ('dVal', False),
+        (1<<6):  ('tVal', False),
+        (1<<7):  ('dtVal', False),
+        (1<<8):  ('vVal', True),
+        (1<<9):  ('eVal', True),
+        (1<<10): ('pVal', True),
+        (1<<11): ('lVal', True),
+        (1<<12): ('mVal', True),
+        (1<<13): ('uVal', True),
+        (1<<14): ('gVal', True),
+        (1<<15): ('ggVal', True),
+        (1<<16): ('duVal', True),
+        (1<<63): ('nVal', False),
+    }
+
     def __init__(self, value):
         self.value = value
 
     def to_string(self):
-        type = self.value['type_']
+        type = int(self.value['type_'])
         if type == 1:
             return "kEmpty"
-        if type == (1<<1):
-            return str(self.value['value_']['bVal'])
-        if type == (1<<2):
-            return str(self.value['value_']['iVal'])
-        if type == (1<<3):
-            return str(self.value['value_']['fVal'])
-        if type == (1<<4):
-            return str(self.deref_from_unique_ptr(self.value['value_']['sVal']))
-        if type == (1<<5):
-            return str(self.value['value_']['dVal'])
-        if type == (1<<6):
-            return str(self.value['value_']['tVal'])
-        if type == (1<<7):
-            return str(self.value['value_']['dtVal'])
-        if type == (1<<8):
-            return str(self.deref_from_unique_ptr(self.value['value_']['vVal']))
-        if type == (1<<9):
-            return str(self.deref_from_unique_ptr(self.value['value_']['eVal']))
-        if type == (1<<10):
-            return str(self.deref_from_unique_ptr(self.value['value_']['pVal']))
-        if type == (1<<11):
-            return str(self.deref_from_unique_ptr(self.value['value_']['lVal']))
-        if type == (1<<12):
-            return str(self.deref_from_unique_ptr(self.value['value_']['mVal']))
-        if type == (1<<13):
-            return str(self.deref_from_unique_ptr(self.value['value_']['uVal']))
-        if type == (1<<14):
-            return str(self.deref_from_unique_ptr(self.value['value_']['gVal']))
-        if type == (1<<15):
-            return str(self.deref_from_unique_ptr(self.value['value_']['ggVal']))
-        if type == (1<<16):
-            return str(self.deref_from_unique_ptr(self.value['value_']['duVal']))
-        if type == (1<<63):
-            return str(self.value['value_']['nVal'])
+        field = self.fields.get(type)
+        if field is None:
+            return None
+        name, boxed = field
+        value = self.value['value_'][name]
+        if boxed:
+            value = self.deref(value)
+        # Returning the gdb.Value lets GDB apply the nested printer lazily.
+        return value
+
+class ListPrinter(NebulaPrinter):
+    def __init__(self, value):
+        self.value = value
+
+    def to_string(self):
+        return "List of length %d" % self.vector_size(self.value['values'])
+
+    def children(self):
+        return self.value_children(self.value['values'])
+
+    def slice(self, start, count):
+        return self.value_slice(self.value['values'], start, count)
+
+    def display_hint(self):
+        return 'array'
+
+class RowPrinter(ListPrinter):
+    def to_string(self):
+        return "Row of length %d" % self.vector_size(self.value['values'])
+
+class SetPrinter(NebulaPrinter):
+    def __init__(self, value):
+        self.value = value
+
+    def to_string(self):
+        return "Set with %d elements" % self.hashtable_size(self.value['values'])
+
+    def children(self):
+        return self.container_children(self.value['values'])
+
+    def display_hint(self):
+        return 'array'
+
+class MapPrinter(NebulaPrinter):
+    def __init__(self, value):
+        self.value = value
+
+    def to_string(self):
+        return "Map with %d elements" % self.hashtable_size(self.value['kvs'])
+
+    def children(self):
+        return self.container_children(self.value['kvs'])
+
+    def display_hint(self):
+        return 'map'
+
+class DataSetPrinter(NebulaPrinter):
+    def __init__(self, value):
+        self.value = value
+
+    def to_string(self):
+        return "DataSet with %d columns, %d rows" % (self.vector_size(self.value['colNames']),
+                                                      self.vector_size(self.value['rows']))
+
+    def children(self):
+        yield ('colNames', self.value['colNames'])
+        for name, row in self.container_children(self.value['rows']):
+            yield (name, row)
+
+class TagPrinter(NebulaPrinter):
+    def __init__(self, value):
+        self.value = value
+
+    def to_string(self):
+        return ":%s with %d props" % (self.short_string(self.value['name']),
+                                      self.hashtable_size(self.value['props']))
+
+    def children(self):
+        return self.container_children(self.value['props'])
+
+    def display_hint(self):
+        return 'map'
+
+class VertexPrinter(NebulaPrinter):
+    def __init__(self, value):
+        self.value = value
+
+    def to_string(self):
+        return "Vertex(%s) with %d tags" % (self.short_string(self.value['vid']),
+                                            self.vector_size(self.value['tags']))
+
+    def children(self):
+        return self.container_children(self.value['tags'])
+
+    def display_hint(self):
+        return 'array'
+
+class EdgePrinter(NebulaPrinter):
+    def __init__(self, value):
+        self.value = value
+
+    def to_string(self):
+        v = self.value
+        return "Edge(%s)-[%s(%d)@%d]->(%s) with %d props" % (
+                self.short_string(v['src']), self.short_string(v['name']), int(v['type']),
+                int(v['ranking']), self.short_string(v['dst']), self.hashtable_size(v['props']))
+
+    def children(self):
+        return self.container_children(self.value['props'])
+
+    def display_hint(self):
+        return 'map'
+
+class StepPrinter(NebulaPrinter):
+    def __init__(self, value):
+        self.value = value
+
+    def to_string(self):
+        v = self.value
+        return "-[%s(%d)@%d]->(%s) with %d props" % (
+                self.short_string(v['name']), int(v['type']), int(v['ranking']),
+                self.short_string(v['dst']['vid']), self.hashtable_size(v['props']))
+
+    def children(self):
+        return self.container_children(self.value['props'])
+
+    def display_hint(self):
+        return 'map'
+
+class PathPrinter(NebulaPrinter):
+    def __init__(self, value):
+        self.value = value
+
+    def to_string(self):
+        return "Path from (%s) with %d steps" % (self.short_string(self.value['src']['vid']),
+                                                 self.vector_size(self.value['steps']))
+
+    def children(self):
+        yield ('src', self.value['src'])
+        for name, step in self.container_children(self.value['steps']):
+            yield (name, step)
+
+class CoordinatePrinter(NebulaPrinter):
+    def __init__(self, value):
+        self.value = value
+
+    def to_string(self):
+        return "(%s %s)" % (float(self.value['x']), float(self.value['y']))
+
+class PointPrinter(NebulaPrinter):
+    def __init__(self, value):
+        self.value = value
+
+    def to_string(self):
+        coord = self.value['coord']
+        return "POINT(%s %s)" % (float(coord['x']), float(coord['y']))
+
+class LineStringPrinter(NebulaPrinter):
+    def __init__(self, value):
+        self.value = value
+
+    def to_string(self):
+        return "LINESTRING with %d points" % self.vector_size(self.value['coordList'])
+
+    def children(self):
+        return self.container_children(self.value['coordList'])
+
+    def display_hint(self):
+        return 'array'
+
+class PolygonPrinter(NebulaPrinter):
+    def __init__(self, value):
+        self.value = value
+
+    def to_string(self):
+        return "POLYGON with %d rings" % self.vector_size(self.value['coordListList'])
+
+    def children(self):
+        return self.container_children(self.value['coordListList'])
+
+    def display_hint(self):
+        return 'array'
+
+class GeographyPrinter(NebulaPrinter):
+    def __init__(self, value):
+        self.value = value
+
+    def to_string(self):
+        # geo_ is a std::variant<Point, LineString, Polygon>
+        geo = self.value['geo_']
+        index = int(geo['_M_index'])
+        try:
+            alternative = geo.type.strip_typedefs().template_argument(index)
+        except RuntimeError:
+            # variant_npos, left by an exception during assignment
+            return "Geography [no contained value]"
+        return geo['_M_u']['_M_first']['_M_storage'].address.cast(alternative.pointer()).dereference()
+
+class DurationPrinter(NebulaPrinter):
+    def __init__(self, value):
+        self.value = value
+
+    def to_string(self):
+        v = self.value
+        return "P%dMT%d.%06dS" % (int(v['months']), int(v['seconds']), int(v['microseconds']))
+
+class ValueVectorPrinter(NebulaPrinter):
+    def __init__(self, value):
+        self.value = value
+
+    def to_string(self):
+        impl = self.value['_M_impl']
+        return "std::vector<nebula::Value> of length %d, capacity %d" % (
+                self.vector_size(self.value), int(impl['_M_end_of_storage'] - impl['_M_start']))
+
+    def children(self):
+        return self.value_children(self.value)
+
+    def slice(self, start, count):
+        return self.value_slice(self.value, start, count)
+
+    def display_hint(self):
+        return 'array'
 
 def build_nebula_printers():
     pp = gdb.printing.RegexpCollectionPrettyPrinter("nebula-printers")
@@ -133,4 +386,21 @@ def build_nebula_printers():
     pp.add_printer("Date", "^nebula::Date$", DatePrinter)
     pp.add_printer("Time", "^nebula::Time$", TimePrinter)
     pp.add_printer("DateTime", "^nebula::DateTime$", DateTimePrinter)
+    pp.add_printer("List", "^nebula::List$", ListPrinter)
+    pp.add_printer("Set", "^nebula::Set$", SetPrinter)
+    pp.add_printer("Map", "^nebula::Map$", MapPrinter)
+    pp.add_printer("Row", "^nebula::Row$", RowPrinter)
+    pp.add_printer("DataSet", "^nebula::DataSet$", DataSetPrinter)
+    pp.add_printer("Tag", "^nebula::Tag$", TagPrinter)
+    pp.add_printer("Vertex", "^nebula::Vertex$", VertexPrinter)
+    pp.add_printer("Edge", "^nebula::Edge$", EdgePrinter)
+    pp.add_printer("Step", "^nebula::Step$", StepPrinter)
+    pp.add_printer("Path", "^nebula::Path$", PathPrinter)
+    pp.add_printer("Coordinate", "^nebula::Coordinate$", CoordinatePrinter)
+    pp.add_printer("Point", "^nebula::Point$", PointPrinter)
+    pp.add_printer("LineString", "^nebula::LineString$", LineStringPrinter)
+    pp.add_printer("Polygon", "^nebula::Polygon$", PolygonPrinter)
+    pp.add_printer("Geography", "^nebula::Geography$", GeographyPrinter)
+    pp.add_printer("Duration", "^nebula::Duration$", DurationPrinter)
+    pp.add_printer("ValueVector", "^std::(__debug::)?vector<nebula::Value,.*>$", ValueVectorPrinter)
     return pp
@@ -0,0 +1,118 @@
+import gdb
+import struct
+from typecache import cached, lookup_type, scalar_format
+
+# Value::Type
+kEmpty = 1
+kBool = 1 << 1
+kInt = 1 << 2
+kFloat = 1 << 3
+kString = 1 << 4
+kDate = 1 << 5
+kTime = 1 << 6
+kDateTime = 1 << 7
+kVertex = 1 << 8
+kEdge = 1 << 9
+kPath = 1 << 10
+kList = 1 << 11
+kMap = 1 << 12
+kSet = 1 << 13
+kDataSet = 1 << 14
+kGeography = 1 << 15
+kDuration = 1 << 16
+kNull = 1 << 63
+
+type_names = {
+    kEmpty: 'kEmpty',
+    kBool: 'kBool',
+    kInt: 'kInt',
+    kFloat: 'kFloat',
+    kString: 'kString',
+    kDate: 'kDate',
+    kTime: 'kTime',
+    kDateTime: 'kDateTime',
+    kVertex: 'kVertex',
+    kEdge: 'kEdge',
+    kPath: 'kPath',
+    kList: 'kList',
+    kMap: 'kMap',
+    kSet: 'kSet',
+    kDataSet: 'kDataSet',
+    kGeography: 'kGeography',
+    kDuration: 'kDuration',
+    kNull: 'kNull',
+}
+
+def struct_format(type):
+    '''Return the struct format of a struct of scalars, or None'''
+    fmt = ''
+    pos = 0
+    for field in sorted(type.strip_typedefs().fields(), key = lambda f: f.bitpos):
+        offset = field.bitpos // 8
+        c = scalar_format(field.type)
+        if c is None or field.bitsize != 0 or offset < pos:
+            return None
+        if offset > pos:
+            fmt = fmt + '%dx' % (offset - pos)
+        fmt = fmt + c
+        pos = offset + field.type.strip_typedefs().sizeof
+    return fmt
+
+
+class ValueLayout:
+    '''Layout of nebula::Value, computed once from debuginfo'''
+    def __init__(self):
+        self.type = lookup_type('nebula::Value').strip_typedefs()
+        self.size = self.type.sizeof
+        fields = dict((f.name, f) for f in self.type.fields())
+        self.tag = struct.Struct('<' + scalar_format(fields['type_'].type))
+        self.tag_offset = fields['type_'].bitpos // 8
+        self.value_offset = fields['value_'].bitpos // 8
+        members = dict((f.name, f.type) for f in fields['value_'].type.strip_typedefs().fields())
+        # Value::Type -> unpacker of the variants stored inline in the union
+        self.scalars = {}
+        for tag, name in ((kBool, 'bVal'), (kInt, 'iVal'), (kFloat, 'fVal'), (kNull, 'nVal')):
+            fmt = scalar_format(members[name])
+            if fmt is not None:
+                self.scalars[tag] = struct.Struct('<' + fmt)
+        for tag, name in ((kDate, 'dVal'), (kTime, 'tVal'), (kDateTime, 'dtVal')):
+            fmt = struct_format(members[name])
+            if fmt is not None:
+                self.scalars[tag] = struct.Struct('<' + fmt)
+
+    def decode(self, addr, count, chunk = 4096):
+        '''Yield (tag, value, raw bytes) of count Values at addr
+
+        value is an int, float or bool for scalar variants, a tuple of fields
+        for dates and times, and None for kEmpty and variants on the heap.
+        '''
+        inferior = gdb.selected_inferior()
+        size = self.size
+        tag_unpack, tag_offset = self.tag.unpack_from, self.tag_offset
+        value_offset = self.value_offset
+        scalars = dict((tag, s.unpack_from) for tag, s in self.scalars.items())
+        for base in range(0, count, chunk):
+            n = min(chunk, count - base)
+            buf = inferior.read_memory(addr + base * size, n * size)
+            for off in range(0, n * size, size):
+                tag, = tag_unpack(buf, off + tag_offset)
+                unpack = scalars.get(tag)
+                value = None
+                if unpack is not None:
+                    value = unpack(buf, off + value_offset)
+                    if len(value) == 1:
+                        value = value[0]
+                yield tag, value, buf[off:off + size]
+
+    def value_at(self, addr):
+        return gdb.Value(addr).cast(self.type.pointer()).dereference()
+
+    def from_bytes(self, raw):
+        try:
+            return gdb.Value(raw, self.type)
+        except:
+            return None
+
+
+def value_layout():
+    return cached(('nebula::Value', 'layout'), ValueLayout)
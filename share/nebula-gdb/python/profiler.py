@@ -0,0 +1,110 @@
+import os
+import sys
+import gdb
+import time
+import builtins
+import importlib.util
+from contextlib import contextmanager
+
+# (name, seconds) of every phase, in completion order
+phases = []
+# module name -> (cumulative seconds, self seconds) of first-time imports
+imports = {}
+
+original_import = builtins.__import__
+import_stack = []
+
+def traced_import(name, globals = None, locals = None, fromlist = (), level = 0):
+    key = name
+    if level != 0:
+        try:
+            key = importlib.util.resolve_name('.' * level + name, (globals or {}).get('__package__'))
+        except:
+            pass
+    if key in sys.modules:
+        return original_import(name, globals, locals, fromlist, level)
+    import_stack.append(0.0)
+    start = time.perf_counter()
+    try:
+        return original_import(name, globals, locals, fromlist, level)
+    finally:
+        elapsed = time.perf_counter() - start
+        children = import_stack.pop()
+        if len(import_stack) != 0:
+            import_stack[-1] = import_stack[-1] + elapsed
+        imports[key] = (elapsed, elapsed - children)
+
+def is_tracing():
+    return builtins.__import__ is traced_import
+
+def trace_imports(on = True):
+    if on:
+        builtins.__import__ = traced_import
+    elif is_tracing():
+        builtins.__import__ = original_import
+
+@contextmanager
+def phase(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        phases.append((name, time.perf_counter() - start))
+
+def report():
+    lines = []
+    total = sum(t for _, t in phases)
+    lines.append(f'nebula-gdb phases: {total * 1000:.1f} ms')
+    for name, t in phases:
+        lines.append(f'  {name:<40} {t * 1000:>9.1f} ms')
+    if len(imports) != 0:
+        lines.append('imports (cumulative, self):')
+        for name, (cum, own) in sorted(imports.items(), key = lambda i: -i[1][0]):
+            lines.append(f'  {name:<40} {cum * 1000:>9.1f} ms {own * 1000:>9.1f} ms')
+    elif not is_tracing():
+        lines.append('imports not traced, set NEBULA_GDB_PROFILE=1 before starting gdb')
+    return '\n'.join(lines)
+
+
+class SetNebulaGdbCommand(gdb.Command):
+    '''Set nebula-gdb options'''
+    def __init__(self):
+        super(SetNebulaGdbCommand, self).__init__('set nebula-gdb', gdb.COMMAND_DATA, gdb.COMPLETE_NONE, True)
+
+class ShowNebulaGdbCommand(gdb.Command):
+    '''Show nebula-gdb options'''
+    def __init__(self):
+        super(ShowNebulaGdbCommand, self).__init__('show nebula-gdb', gdb.COMMAND_DATA, gdb.COMPLETE_NONE, True)
+
+class ProfileParameter(gdb.Parameter):
+    '''Set whether module imports of nebula-gdb are timed
+
+    The parameter is defined while nebula-gdb.py is sourced, so turning it on
+    only times later imports, e.g. of lazily loaded commands. Set
+    NEBULA_GDB_PROFILE=1 in the environment to time startup imports as well.
+    '''
+    set_doc = 'Set whether nebula-gdb records import timings'
+    show_doc = 'Show whether nebula-gdb records import timings'
+    def __init__(self):
+        super(ProfileParameter, self).__init__('nebula-gdb profile', gdb.COMMAND_DATA, gdb.PARAM_BOOLEAN)
+        self.value = is_tracing()
+
+    def get_set_string(self):
+        trace_imports(self.value)
+        return ''
+
+class StartupReportCommand(gdb.Command):
+    '''Show time spent in each nebula-gdb startup phase and module import'''
+    def __init__(self):
+        super(StartupReportCommand, self).__init__('nebula-gdb-startup', gdb.COMMAND_USER)
+
+    def invoke(self, args, is_tty):
+        print(report())
+
+if os.environ.get('NEBULA_GDB_PROFILE'):
+    trace_imports()
+
+SetNebulaGdbCommand()
+ShowNebulaGdbCommand()
+ProfileParameter()
+StartupReportCommand()
@@ -1,8 +1,14 @@
 import os
+import re
 import sys
 import gdb
 import struct
+import bisect
+import importlib
 import resource
+from array import array
+from collections import OrderedDict
+from typecache import cached
 
 if sys.version_info[0] < 3:
     pass
@@ -12,7 +18,58 @@ else:
     from importlib import reload
 
 
-gdb.mmaps = []
+class AddressSpace:
+    '''Sorted, merged set of mapped address ranges'''
+    def __init__(self, ranges = ()):
+        self.begins = array('Q')
+        self.ends = array('Q')
+        for b, e in sorted(ranges):
+            if b >= e:
+                continue
+            if len(self.ends) != 0 and b <= self.ends[-1]:
+                if e > self.ends[-1]:
+                    self.ends[-1] = e
+                continue
+            self.begins.append(b)
+            self.ends.append(e)
+
+    def __len__(self):
+        return len(self.begins)
+
+    def __iter__(self):
+        return zip(self.begins, self.ends)
+
+    def __contains__(self, addr):
+        return self.find(addr) is not None
+
+    def find(self, addr):
+        '''Return the (begin, end) range containing addr, or None'''
+        if addr < 0 or addr > 0xffffffffffffffff:
+            return None
+        i = bisect.bisect_right(self.begins, addr) - 1
+        if i < 0 or addr >= self.ends[i]:
+            return None
+        return self.begins[i], self.ends[i]
+
+    def classify(self, addrs):
+        '''Return a list of bools telling whether each of addrs is mapped'''
+        result = [False] * len(addrs)
+        if len(self.begins) == 0:
+            return result
+        begins, ends = self.begins, self.ends
+        n = len(begins)
+        i = 0
+        for k in sorted(range(len(addrs)), key = addrs.__getitem__):
+            addr = addrs[k]
+            while i < n and ends[i] <= addr:
+                i = i + 1
+            if i == n:
+                break
+            result[k] = begins[i] <= addr
+        return result
+
+
+gdb.mmaps = AddressSpace()
 
 # gdb a.out
 def has_prog():
@@ -38,11 +95,92 @@ def is_exited():
 def is_running():
     return is_active() and not is_exited()
 
+class PageCache:
+    '''LRU cache of inferior memory in fixed-size blocks'''
+    # Budget charged for an unreadable block, so that scans of unmapped
+    # memory cannot grow the cache without bound
+    negative_size = 64
+
+    def __init__(self, budget = 64 << 20, block_size = 64 << 10):
+        self.budget = budget
+        self.block_size = block_size
+        self.blocks = OrderedDict()
+        self.used = 0
+
+    def clear(self, *args):
+        self.blocks.clear()
+        self.used = 0
+
+    def resize(self, budget):
+        self.budget = budget
+        self.evict()
+
+    def evict(self):
+        while self.used > self.budget and len(self.blocks) != 0:
+            _, block = self.blocks.popitem(last = False)
+            self.used = self.used - self.size_of(block)
+
+    def size_of(self, block):
+        return self.negative_size if block is None else len(block[1])
+
+    def block(self, inferior, index):
+        key = (inferior.num, index)
+        block = self.blocks.get(key, False)
+        if block is not False:
+            self.blocks.move_to_end(key)
+            return block
+        base = index * self.block_size
+        end = base + self.block_size
+        try:
+            data = inferior.read_memory(base, end - base).tobytes()
+        except:
+            # The block straddles the edge of a mapping, read only the mapped part.
+            try:
+                if len(gdb.mmaps) == 0:
+                    load_memory_space()
+                r = gdb.mmaps.find(base) or gdb.mmaps.find(end - 1)
+                base, end = max(base, r[0]), min(end, r[1])
+                data = inferior.read_memory(base, end - base).tobytes()
+            except:
+                data = None
+        block = None if data is None else (base, data)
+        self.blocks[key] = block
+        self.used = self.used + self.size_of(block)
+        self.evict()
+        return block
+
+    def read(self, inferior, addr, size):
+        if size > self.budget // 4:
+            return inferior.read_memory(addr, size).tobytes()
+        chunks = []
+        cur, end = addr, addr + size
+        while cur < end:
+            block = self.block(inferior, cur // self.block_size)
+            if block is None or cur < block[0] or cur >= block[0] + len(block[1]):
+                return inferior.read_memory(addr, size).tobytes()
+            base, data = block
+            n = min(end - cur, base + len(data) - cur)
+            chunks.append(data[cur - base : cur - base + n])
+            cur = cur + n
+        return b''.join(chunks)
+
+
+if hasattr(gdb, 'page_cache'):
+    for event in (gdb.events.stop, gdb.events.cont, gdb.events.memory_changed,
+                  gdb.events.exited, gdb.events.new_objfile):
+        event.disconnect(gdb.page_cache.clear)
+gdb.page_cache = PageCache()
+for event in (gdb.events.stop, gdb.events.cont, gdb.events.memory_changed,
+              gdb.events.exited, gdb.events.new_objfile):
+    event.connect(gdb.page_cache.clear)
+
+def read(addr, size):
+    return gdb.page_cache.read(gdb.selected_inferior(), addr, size)
+
 def x(addr, fmt, n = 1):
     try:
-        inferior = gdb.selected_inferior()
-        mview = inferior.read_memory(addr, struct.calcsize(fmt) * n)
-        return mview.cast(fmt).tolist()
+        data = read(addr, struct.calcsize(fmt) * n)
+        return memoryview(data).cast(fmt).tolist()
     except:
         raise ValueError(f"Failed to read {n} objects in '{fmt}' format at {addr:#x}")
 
@@ -53,12 +191,126 @@ def reg(regname):
     except:
         raise ValueError(f'Failed to read register ${regname}')
 
-def tid():
+def stack_pointer():
     if is_x64():
-        return x(reg('fs_base') + 720, 'I')[0]
-    elif is_arm64() and is_running():
-        return x(int(gdb.parse_and_eval('pthread_self()')) + 208, 'I')[0]
+        return reg('rsp')
+    elif is_arm64():
+        return reg('sp')
     else:
+        raise ValueError('Cannot retrieve stack pointer')
+
+pthread_fields = ('tid', 'stackblock', 'stackblock_size', 'guardsize')
+
+# Offsets and size of struct pthread of common glibc 2.2x/2.3x builds, used
+# when neither libc debuginfo nor a layout saved from it is available. They
+# are only a best guess: the struct changes between glibc releases and
+# distribution patches, so stack ranges read with them may be wrong.
+pthread_offsets = {
+    'x86_64': {'tid': 720, 'stackblock': 1680, 'stackblock_size': 1688, 'guardsize': 1696, 'sizeof': 2304},
+    'aarch64': {'tid': 208, 'stackblock': 1168, 'stackblock_size': 1176, 'guardsize': 1184, 'sizeof': 1792},
+}
+
+def libc_build_id():
+    for objfile in gdb.objfiles():
+        if getattr(objfile, 'owner', None) is not None:
+            continue
+        name = os.path.basename(objfile.filename or '')
+        if name.startswith('libc.so') or re.match(r'libc-[\d.]+\.so', name):
+            return getattr(objfile, 'build_id', None)
+    return None
+
+def pthread_layout_path(build_id):
+    root = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(root, 'nebula-gdb', 'pthread', build_id + '.json')
+
+def compute_pthread_layout():
+    import json
+    build_id = libc_build_id()
+    try:
+        type = gdb.lookup_type('struct pthread')
+        fields = dict((f.name, f.bitpos // 8) for f in type.fields() if hasattr(f, 'bitpos'))
+        layout = dict((name, fields[name]) for name in pthread_fields)
+        layout['sizeof'] = type.sizeof
+    except (gdb.error, RuntimeError, KeyError):
+        layout = None
+    if layout is not None:
+        # Saved by build-id, so that cores of hosts without libc debuginfo
+        # find it later.
+        if build_id is not None:
+            path = pthread_layout_path(build_id)
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok = True)
+                with open(path + '.tmp', 'w') as f:
+                    json.dump(layout, f)
+                os.replace(path + '.tmp', path)
+            except OSError:
+                pass
+        return layout
+    if build_id is not None:
+        try:
+            with open(pthread_layout_path(build_id)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            pass
+    layout = pthread_offsets.get(arch())
+    if layout is None:
+        raise ValueError(f'Unknown struct pthread layout on {arch()}')
+    return layout
+
+def pthread_layout():
+    '''Return offsets of the fields of struct pthread, and its sizeof if known'''
+    return cached('struct pthread layout', compute_pthread_layout)
+
+def pthread_self():
+    '''Return the address of the struct pthread of the selected thread, without calling into the inferior'''
+    try:
+        # pthread_t, which is the struct address in glibc, known through libthread_db
+        handle = gdb.selected_thread().handle()
+        addr = int.from_bytes(handle, 'little') if handle else 0
+        if addr != 0:
+            return addr
+    except:
+        pass
+    if is_x64():
+        return reg('fs_base')
+    elif is_arm64():
+        # The thread pointer follows struct pthread on arm64.
+        size = pthread_layout().get('sizeof')
+        if size is not None:
+            return reg('tpidr') - size
+    raise ValueError('Cannot locate struct pthread without libthread_db or libc debuginfo')
+
+def read_pthreads(addrs):
+    '''Return (tid, stack base above the guard, stack bottom) of the struct pthread at each of addrs,
+    or None where it cannot be read
+
+    Every struct is read once, from its first to its last field of interest.
+    '''
+    layout = pthread_layout()
+    offsets = dict((name, layout[name]) for name in pthread_fields)
+    lo = min(offsets.values())
+    hi = max(offsets.values()) + 8
+    inferior = gdb.selected_inferior()
+    result = []
+    for addr in addrs:
+        try:
+            buf = inferior.read_memory(addr + lo, hi - lo)
+        except gdb.MemoryError:
+            result.append(None)
+            continue
+        def field(name, fmt = 'Q'):
+            return struct.unpack_from('<' + fmt, buf, offsets[name] - lo)[0]
+        base, size, guard_size = field('stackblock'), field('stackblock_size'), field('guardsize')
+        result.append((field('tid', 'i'), base + guard_size, base + size))
+    return result
+
+def tid():
+    lwp = gdb.selected_thread().ptid[1]
+    if lwp != 0:
+        return lwp
+    try:
+        return read_pthreads([pthread_self()])[0][0]
+    except:
         raise ValueError('Cannot retrieve thread id')
 
 def pid():
@@ -84,21 +336,13 @@ def arch():
 def stack_range():
     if not is_main_thread():
         try:
-            if is_x64():
-                base, size, guard_size = x(reg('fs_base') + 1680, 'Q', 3)
-                bottom = base + size
-                base = base + guard_size
-                return base, bottom
-            elif is_arm64():
-                base, size, guard_size = x(int(gdb.parse_and_eval('pthread_self()')) + 1168, 'Q', 3)
-                bottom = base + size
-                base = base + guard_size
-                return base, bottom
-            else:
-                raise ValueError('Cannot retrieve stack range')
+            _, base, bottom = read_pthreads([pthread_self()])[0]
+            return base, bottom
         except:
             raise ValueError('Cannot retrieve stack range')
+    return main_stack_range()
 
+def main_stack_range():
     try:
         sym = gdb.lookup_global_symbol('__libc_stack_end')
         bottom = int(sym.value())
@@ -110,6 +354,7 @@ def stack_range():
 
 
 def __load_from_core():
+    ranges = []
     lines = gdb.execute('maintenance info sections', to_string = True).splitlines()
     skip = True
     skip_header = 2
@@ -128,56 +373,139 @@ def __load_from_core():
         fields = line.strip().split()
         b, e = fields[1].split('->')
         b, e = int(b, 16), int(e, 16)
-        gdb.mmaps.append((b, e))
+        ranges.append((b, e))
+    return ranges
 
 
 def __load_from_proc():
+    ranges = []
     pid = gdb.selected_inferior().pid
     lines = os.popen('cat /proc/%d/maps' % pid).read().splitlines()
     lines = [ line.strip().split(None, 5) for line in lines ]
     for records in lines:
         b, e = records[0].split('-')
         b, e = int(b, 16), int(e, 16)
-        gdb.mmaps.append((b, e))
+        ranges.append((b, e))
+    return ranges
 
 def load_memory_space():
     if len(gdb.mmaps) != 0:
         return
 
     if is_running():
-        __load_from_proc()
+        ranges = __load_from_proc()
     else:
-        __load_from_core()
+        ranges = __load_from_core()
+    gdb.mmaps = AddressSpace(ranges)
 
 
 def is_valid_addr(addr):
     if len(gdb.mmaps) == 0:
         load_memory_space()
-    for b, e in gdb.mmaps:
-        if addr >=b and addr < e:
-            return True
-    return False
+    return addr in gdb.mmaps
 
-def is_str_at_addr(addr):
-    s = addr
+def are_valid_addrs(addrs):
+    if len(gdb.mmaps) == 0:
+        load_memory_space()
+    return gdb.mmaps.classify(addrs)
+
+max_str_len = 4096
+printable = re.compile(rb'[\x20-\x7e]*')
+
+def is_str_at_addr(addr, limit = None):
+    if limit is None:
+        limit = max_str_len
+    if len(gdb.mmaps) == 0:
+        load_memory_space()
+    r = gdb.mmaps.find(addr)
+    if r is None:
+        return False, 0
+    end = min(r[1], addr + limit)
     n = 0
-    while True:
-        if not is_valid_addr(s):
+    s = addr
+    chunk = 256
+    while s < end:
+        size = min(chunk, end - s)
+        try:
+            data = read(s, size)
+        except:
             break
-        c = x(s, 'c')[0]
-        if ord(c) < 0x20 or ord(c) > 0x7e:
+        m = printable.match(data).end()
+        n = n + m
+        if m < size:
             break
-        n = n + 1
-        s = s + 1
+        s = s + size
+        chunk = min(chunk * 4, gdb.page_cache.block_size)
     return n > 2, n
 
 
-if 'rsp.cmd' in sys.modules:
-    reload(rsp.cmd)
-else:
-    import rsp.cmd
+def load_module(name):
+    if name in sys.modules:
+        return reload(sys.modules[name])
+    return importlib.import_module(name)
 
-if 'rsp.filter' in sys.modules:
-    reload(rsp.filter)
-else:
-    import rsp.filter
+for name in ('rsp.elf', 'rsp.symbol'):
+    if name in sys.modules:
+        reload(sys.modules[name])
+
+
+class LazyCommand(gdb.Command):
+    '''Stub that imports the module implementing a command on first invoke'''
+    def __init__(self, name, module):
+        super(LazyCommand, self).__init__(name, gdb.COMMAND_USER)
+        self.name = name
+        self.module = module
+        self.loaded = False
+
+    def invoke(self, args, is_tty):
+        if self.loaded:
+            raise gdb.GdbError(f"'{self.name}' is not provided by {self.module}")
+        self.loaded = True
+        # The module registers the real command, which replaces this stub.
+        load_module(self.module)
+        gdb.execute(f'{self.name} {args}', is_tty)
+
+commands = [
+    ('rsp-reload', 'rsp.cmd', 'Reload the rsp package'),
+    ('show-stack-info', 'rsp.cmd', 'Show various info about the current stack'),
+    ('all-stack-info', 'rsp.cmd', 'Show stack range and usage of all threads, sorted by usage'),
+    ('unique-stacks', 'rsp.cmd', 'Print the backtraces of all threads, one entry per unique stack'),
+    ('bt-fast', 'rsp.cmd', 'Print backtraces with function names only, without arguments or frame filters'),
+    ('rsp-patterns', 'rsp.filter', 'Reload and show the patterns shortening function names in backtraces'),
+    ('xrange', 'rsp.cmd', 'Examine contents in a range of memory area'),
+    ('xstack', 'rsp.cmd', 'Examine contents in the current stack'),
+    ('show-asm-tips', 'rsp.cmd', 'Show brief assembly tips of arm or x86'),
+    ('pstr', 'rsp.cmd', 'Print fields of std::string, useful if no debuginfo'),
+    ('pvec', 'rsp.cmd', 'Print fields of std::vector, useful if no debuginfo'),
+    ('phash-table', 'rsp.cmd', 'Print fields and bucket distribution of std::unordered_map/set, useful if no debuginfo'),
+    ('pshared-ptr', 'rsp.cmd', 'Print fields of std::shared_ptr, useful if no debuginfo'),
+    ('pslice', 'rsp.cmd', 'Print elements [start, start + count) of a std::vector, deque, map, set or unordered container'),
+    ('pmap-stats', 'rsp.cmd', 'Show node count, tree height and key range of a std::map or std::set'),
+    ('psyscall', 'rsp.cmd', 'Print syscall names and numbers'),
+]
+
+def lazy_command(name, module, doc):
+    '''Register a stub for command name, implemented by module'''
+    stub = type('LazyCommand', (LazyCommand,), {'__doc__': doc})
+    return stub(name, module)
+
+for name, module, doc in commands:
+    lazy_command(name, module, doc)
+
+
+class LazyFrameFilter():
+    '''Stub that imports rsp.filter when the first backtrace is printed'''
+    def __init__(self):
+        self.name = 'PrettyTemplate'
+        self.enabled = True
+        self.priority = 100
+        gdb.frame_filters[self.name] = self
+
+    def filter(self, fi):
+        # rsp.filter registers the real filter under the same name.
+        load_module('rsp.filter')
+        return gdb.frame_filters[self.name].filter(fi)
+
+LazyFrameFilter()
+
+load_module('rsp.param')
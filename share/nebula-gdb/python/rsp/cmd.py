@@ -1,6 +1,8 @@
 import re
 import gdb
+import time
 import rsp
+import rsp.symbol
 from rsp import *
 
 def active(invoke):
@@ -41,15 +43,241 @@ class ShowStackCommand(gdb.Command):
     @catch
     def invoke(self, args, is_tty):
         start, end = stack_range()
-        if is_x64():
-            top = reg('rsp')
-        elif is_arm64():
-            top = reg('sp')
+        top = stack_pointer()
         print(f"bottom: {end:#x}, top: {top:#x}, size: {end-start}, usage: {end-top}")
 
 ShowStackCommand()
 
 
+class ShowAllStacksCommand(gdb.Command):
+    '''Show stack range and usage of all threads, sorted by usage'''
+    def __init__(self):
+        super(ShowAllStacksCommand, self).__init__('all-stack-info', gdb.COMMAND_USER)
+
+    @active
+    @catch
+    def invoke(self, args, is_tty):
+        args = args.split()
+        if len(args) > 1:
+            print('all-stack-info [warn percent]')
+            return
+        warn = float(args[0]) if len(args) == 1 else 90.0
+
+        # One pass over the threads for registers only, the structs are read after.
+        threads = sorted(gdb.selected_inferior().threads(), key = lambda t: t.num)
+        rows = []
+        pthreads = []
+        thread, frame = gdb.selected_thread(), gdb.selected_frame()
+        try:
+            for t in threads:
+                t.switch()
+                lwp = t.ptid[1]
+                try:
+                    top = stack_pointer()
+                    if lwp != pid():
+                        pthreads.append((len(rows), pthread_self()))
+                        rows.append([t.num, lwp, top, None])
+                    else:
+                        rows.append([t.num, lwp, top, main_stack_range()])
+                except Exception as e:
+                    rows.append([t.num, lwp, None, str(e)])
+        finally:
+            thread.switch()
+            frame.select()
+
+        for (i, _), info in zip(pthreads, read_pthreads([addr for _, addr in pthreads])):
+            rows[i][3] = 'cannot read struct pthread' if info is None else info[1:]
+
+        def usage(row):
+            num, lwp, top, stack = row
+            return stack[1] - top if isinstance(stack, tuple) else -1
+        rows.sort(key = usage, reverse = True)
+
+        print(f'{"thread":>7} {"lwp":>8} {"bottom":>18} {"size":>10} {"usage":>10} {"used":>7}')
+        near = 0
+        for num, lwp, top, stack in rows:
+            if not isinstance(stack, tuple):
+                print(f'{num:>7} {lwp:>8} {stack}')
+                continue
+            base, bottom = stack
+            size = bottom - base
+            used = bottom - top
+            percent = used * 100.0 / size if size > 0 else 0.0
+            line = f'{num:>7} {lwp:>8} {bottom:#18x} {size:>10} {used:>10} {percent:6.1f}%'
+            if top < base or percent >= warn:
+                line = line + '  <- near guard page'
+                near = near + 1
+            print(line)
+        print(f'{len(rows)} threads, {near} at or above {warn}% of their stack')
+
+ShowAllStacksCommand()
+
+
+def pc_chain(depth):
+    '''Return the pcs of at most depth frames of the selected thread, decoding nothing else'''
+    pcs = []
+    try:
+        frame = gdb.newest_frame()
+        while frame is not None and len(pcs) < depth:
+            pcs.append(frame.pc())
+            frame = frame.older()
+    except gdb.error:
+        pass
+    return tuple(pcs)
+
+def thread_ranges(nums):
+    '''Format sorted thread numbers like 1-4,7'''
+    ranges = []
+    for num in nums:
+        if len(ranges) != 0 and ranges[-1][1] == num - 1:
+            ranges[-1][1] = num
+        else:
+            ranges.append([num, num])
+    return ','.join(str(a) if a == b else f'{a}-{b}' for a, b in ranges)
+
+
+class UniqueStacksCommand(gdb.Command):
+    '''Print the backtraces of all threads, one entry per unique stack'''
+    def __init__(self):
+        super(UniqueStacksCommand, self).__init__('unique-stacks', gdb.COMMAND_USER)
+
+    @active
+    @catch
+    def invoke(self, args, is_tty):
+        args = args.split()
+        if len(args) > 1:
+            print('unique-stacks [max depth]')
+            return
+        depth = int(args[0]) if len(args) == 1 else 64
+        import rsp.filter
+
+        # Only pcs are collected, arguments and locals are never evaluated.
+        stacks = {}
+        names = {}
+        threads = sorted(gdb.selected_inferior().threads(), key = lambda t: t.num)
+        thread, frame = gdb.selected_thread(), gdb.selected_frame()
+        try:
+            for t in threads:
+                t.switch()
+                stacks.setdefault(pc_chain(depth), []).append(t)
+            # Names come from the frames of one thread per stack, so inlined
+            # functions show as they do in bt.
+            for stack, members in stacks.items():
+                members[0].switch()
+                names[stack] = self.frame_names(len(stack))
+        finally:
+            thread.switch()
+            frame.select()
+
+        print(f'{len(threads)} threads, {len(stacks)} unique stacks')
+        for stack, members in sorted(stacks.items(), key = lambda s: (-len(s[1]), s[1][0].num)):
+            print()
+            print(f'{len(members)} threads: {thread_ranges([t.num for t in members])}')
+            for i, (pc, name) in enumerate(zip(stack, names[stack])):
+                print(f'#{i:<3} {pc:#018x} in {name}')
+
+    def frame_names(self, depth):
+        result = []
+        try:
+            frame = gdb.newest_frame()
+            while frame is not None and len(result) < depth:
+                name = frame.name()
+                name = '??' if name is None else rsp.filter.pretty_name(name)
+                if frame.type() == gdb.INLINE_FRAME:
+                    name = name + ' [inlined]'
+                result.append(name)
+                frame = frame.older()
+        except gdb.error:
+            pass
+        return result + ['??'] * (depth - len(result))
+
+UniqueStacksCommand()
+
+
+class FastBacktraceCommand(gdb.Command):
+    '''Print backtraces with function names only, without arguments or frame filters'''
+    def __init__(self):
+        super(FastBacktraceCommand, self).__init__('bt-fast', gdb.COMMAND_USER)
+
+    @active
+    @catch
+    def invoke(self, args, is_tty):
+        args = args.split()
+        all_threads = '-all' in args
+        bench = '-bench' in args
+        args = [arg for arg in args if arg not in ('-all', '-bench')]
+        if len(args) > 1 or any(arg.startswith('-') for arg in args):
+            print('bt-fast [-all] [-bench] [max depth]')
+            return
+        depth = int(args[0]) if len(args) == 1 else None
+        import rsp.filter
+
+        if all_threads:
+            threads = sorted(gdb.selected_inferior().threads(), key = lambda t: t.num)
+        else:
+            threads = [gdb.selected_thread()]
+        if bench:
+            self.bench(threads, depth)
+        else:
+            self.run(threads, depth, gdb.write)
+
+    def run(self, threads, depth, write):
+        thread, frame = gdb.selected_thread(), gdb.selected_frame()
+        try:
+            for t in threads:
+                if len(threads) > 1:
+                    t.switch()
+                    write(f'\nThread {t.num} (LWP {t.ptid[1]}):\n')
+                self.backtrace(depth, write)
+        finally:
+            thread.switch()
+            frame.select()
+
+    def backtrace(self, depth, write):
+        # Lines are written as frames are unwound, pretty_name is memoized.
+        i = 0
+        try:
+            frame = gdb.newest_frame()
+            while frame is not None and (depth is None or i < depth):
+                name = frame.name()
+                name = '??' if name is None else rsp.filter.pretty_name(name)
+                write(f'#{i:<3} {frame.pc():#018x} in {name}\n')
+                frame = frame.older()
+                i = i + 1
+        except gdb.error as e:
+            write(f'Backtrace stopped: {e}\n')
+
+    def bench(self, threads, depth):
+        '''Time bt-fast against plain bt over the same threads'''
+        def timed(run):
+            # Drop unwound frames, so that neither run reuses the other's.
+            if hasattr(gdb, 'invalidate_cached_frames'):
+                gdb.invalidate_cached_frames()
+            start = time.perf_counter()
+            run()
+            return time.perf_counter() - start
+
+        lines = []
+        fast = timed(lambda: self.run(threads, depth, lines.append))
+        frames = sum(1 for line in lines if line.startswith('#'))
+
+        bt = 'bt' if depth is None else f'bt {depth}'
+        def plain():
+            thread, frame = gdb.selected_thread(), gdb.selected_frame()
+            try:
+                for t in threads:
+                    t.switch()
+                    gdb.execute(bt, to_string = True)
+            finally:
+                thread.switch()
+                frame.select()
+        slow = timed(plain)
+        print(f'{len(threads)} threads, {frames} frames')
+        print(f'bt-fast: {fast:.3f}s, bt: {slow:.3f}s, {slow / max(fast, 1e-9):.1f}x')
+
+FastBacktraceCommand()
+
+
 class ExamineRangeCommand(gdb.Command):
     '''Examine contents in a range of memory area'''
     def __init__(self):
@@ -88,8 +316,9 @@ class ExamineRangeCommand(gdb.Command):
             print('Memory cannot be accessed at 0x%x' % (end - 1))
             return
 
-        addrs = x(start, 'Q', (end - start) / 8)
-        addrs = [(i * 8, addr) for i, addr in enumerate(addrs) if is_valid_addr(addr)]
+        words = x(start, 'Q', (end - start) // 8)
+        valid = are_valid_addrs(words)
+        addrs = [(i * 8, addr) for i, addr in enumerate(words) if valid[i]]
 
         if len(addrs) == 0:
             return
@@ -102,12 +331,11 @@ class ExamineRangeCommand(gdb.Command):
             offset_width = offset_width + 1
             maxoffset = maxoffset >> 4
 
-        for i,addr in addrs:
+        syms = rsp.symbol.symbolize([addr for _, addr in addrs])
+        for (i,addr),sym in zip(addrs, syms):
             line = f'{start:#x}+{i:#0{offset_width}x}: {addr:#x}'
             to_print = False
-            out = gdb.execute('info symbol 0x%x' % addr, to_string = True)
-            out = out[:-1]
-            ok, n = is_str_at_addr(addr)
+            ok, n = is_str_at_addr(addr, 65)
             string = None
             if ok:
                 tail = ''
@@ -116,22 +344,13 @@ class ExamineRangeCommand(gdb.Command):
                     tail = '...'
                 string = ' -> "' + ''.join(c.decode() for c in x(addr, 'c', n)) + tail + '"'
                 to_print = True
-            if not 'No symbol' in out:
-                try:
-                    if not hasattr(gdb, 'symbol_line_pattern'):
-                        gdb.symbol_line_pattern = re.compile(r'^([^+]+) \+?( \d+ )?in section .* of (.*)$')
-                    pattern = gdb.symbol_line_pattern
-                    match = pattern.match(out)
-                    func = match.group(1)
-                    offset = match.group(2)
-                    objfile = match.group(3)
-                    if offset is None:
-                        line = f'{line} -> <{func}>'
-                    else:
-                        line = f'{line} -> <{func}+{int(offset):#x}>'
-                    to_print = True
-                except:
-                    raise
+            if sym is not None:
+                func, offset = sym
+                if offset == 0:
+                    line = f'{line} -> <{func}>'
+                else:
+                    line = f'{line} -> <{func}+{offset:#x}>'
+                to_print = True
 
             if not string == None:
                 line = line + string
@@ -151,12 +370,7 @@ class ExamineStackCommand(gdb.Command):
     @catch
     def invoke(self, args, is_tty):
         start, end = stack_range()
-        if is_x64():
-            top = reg('rsp')
-        elif is_arm64():
-            top = reg('sp')
-        bottom = end
-        gdb.execute('xrange %d %d' % (top, bottom))
+        gdb.execute('xrange %d %d' % (stack_pointer(), end))
 
 ExamineStackCommand()
 
@@ -363,15 +577,17 @@ PrintStdVectorCommand()
 
 
 class PrintStdHashtableCommand(gdb.Command):
-    '''Print fields of std::unordered_map/set, useful if no debuginfo'''
+    '''Print fields and bucket distribution of std::unordered_map/set, useful if no debuginfo
+
+The node size used to estimate memory comes from debuginfo, or the second argument.'''
     def __init__(self):
         super(PrintStdHashtableCommand, self).__init__('phash-table', gdb.COMMAND_USER)
 
     @catch
     def invoke(self, args, is_tty):
         args = args.split()
-        if len(args) != 1:
-            print('phashtable <addr>')
+        if len(args) not in (1, 2):
+            print('phash-table <addr> [node size]')
             return
         value = gdb.parse_and_eval(args[0])
         tcode = value.type.code
@@ -382,6 +598,62 @@ class PrintStdHashtableCommand(gdb.Command):
         buckets, nbuckets, _, size = x(addr, 'Q', 4)
         load_factor = x(addr + 32, 'f', 1)[0]
         print(f'buckets: {buckets:#x}, bucket count: {nbuckets}, size: {size}, load factor: {load_factor}')
+        node_size = int(args[1]) if len(args) == 2 else self.node_size(value)
+        self.show_distribution(addr, buckets, nbuckets, size, node_size)
+
+    def node_size(self, value):
+        type = value.type.strip_typedefs()
+        if type.code == gdb.TYPE_CODE_PTR:
+            type = type.target().strip_typedefs()
+        if type.code != gdb.TYPE_CODE_STRUCT:
+            return None
+        try:
+            from libstdcxx.v6.printers import find_type
+            fields = [f.type for f in type.fields() if f.name == '_M_h']
+            return find_type(fields[0] if fields else type, '__node_type').sizeof
+        except:
+            return None
+
+    def show_distribution(self, addr, buckets, nbuckets, size, node_size):
+        # Each non-empty bucket points to the node before its first one, so
+        # walking the single node list and checking every predecessor against
+        # those pointers splits it into chains.
+        heads = dict((p, i) for i, p in enumerate(x(buckets, 'Q', nbuckets)) if p)
+        chains = []
+        bucket, length = None, 0
+        prev = addr + 16
+        node = x(prev, 'Q')[0]
+        walked = 0
+        while node and walked < size:
+            if prev in heads:
+                if bucket is not None:
+                    chains.append((length, bucket))
+                bucket, length = heads[prev], 0
+            length = length + 1
+            walked = walked + 1
+            prev, node = node, x(node, 'Q')[0]
+        if bucket is not None:
+            chains.append((length, bucket))
+
+        histogram = {0: nbuckets - len(chains)}
+        for length, _ in chains:
+            histogram[length] = histogram.get(length, 0) + 1
+        print('chain length: buckets')
+        for length in sorted(histogram):
+            print(f'{length:>12}: {histogram[length]}')
+        if len(chains) != 0:
+            longest, bucket = max(chains)
+            print(f'used buckets: {len(chains)}, longest chain: {longest} (bucket {bucket}), '
+                  f'average chain: {walked / len(chains):.2f}')
+        if walked != size:
+            print(f'only {walked} of {size} nodes reachable, the table may be corrupted')
+
+        # A table with one bucket uses _M_single_bucket instead of an array.
+        array = 0 if buckets == addr + 48 else nbuckets * 8
+        if node_size is None:
+            print(f'memory: {array} bytes of buckets, pass the node size to estimate the nodes')
+        else:
+            print(f'memory: ~{array + size * node_size} bytes, {array} of buckets and {size} nodes of {node_size}')
 
 PrintStdHashtableCommand()
 
@@ -411,8 +683,87 @@ class PrintStdSharedPtrcommand(gdb.Command):
 PrintStdSharedPtrcommand()
 
 
+class PrintSliceCommand(gdb.Command):
+    '''Print elements [start, start + count) of a std::vector, deque, map, set or unordered container'''
+    def __init__(self):
+        super(PrintSliceCommand, self).__init__('pslice', gdb.COMMAND_USER)
+
+    @catch
+    def invoke(self, args, is_tty):
+        args = gdb.string_to_argv(args)
+        if len(args) != 3:
+            print('pslice <expr> <start> <count>')
+            return
+        value = gdb.parse_and_eval(args[0])
+        if value.type.strip_typedefs().code == gdb.TYPE_CODE_PTR:
+            value = value.dereference()
+        start = int(gdb.parse_and_eval(args[1]))
+        count = int(gdb.parse_and_eval(args[2]))
+        if start < 0 or count < 0:
+            print('start and count must not be negative')
+            return
+        # The printers locate the window directly instead of iterating up to it.
+        printer = gdb.default_visualizer(value)
+        if printer is None or not hasattr(printer, 'slice'):
+            print(f"'{args[0]}' has no printer supporting slices")
+            return
+        print(printer.to_string())
+        children = iter(printer.slice(start, count))
+        hint = printer.display_hint() if hasattr(printer, 'display_hint') else None
+        if hint == 'map':
+            for (_, key), (_, val) in zip(children, children):
+                print(f'[{key}] = {val}')
+        else:
+            for name, val in children:
+                print(f'{name} = {val}')
+
+PrintSliceCommand()
+
+
+class PrintMapStatsCommand(gdb.Command):
+    '''Show node count, tree height and key range of a std::map or std::set'''
+    def __init__(self):
+        super(PrintMapStatsCommand, self).__init__('pmap-stats', gdb.COMMAND_USER)
+
+    @catch
+    def invoke(self, args, is_tty):
+        from libstdcxx.v6.printers import find_type, rbtree_walk, get_value_from_Rb_tree_node
+        args = gdb.string_to_argv(args)
+        if len(args) != 1:
+            print('pmap-stats <expr>')
+            return
+        value = gdb.parse_and_eval(args[0])
+        if value.type.strip_typedefs().code == gdb.TYPE_CODE_PTR:
+            value = value.dereference()
+        impl = value['_M_t']['_M_impl']
+        header = impl['_M_header']
+        count = int(impl['_M_node_count'])
+        link = find_type(find_type(value.type, '_Rep_type'), '_Link_type').strip_typedefs()
+        print(f'nodes: {count}, node size: {link.target().sizeof}, ~{count * link.target().sizeof} bytes')
+        if count == 0:
+            return
+        # Only the headers are read, values are never built.
+        visited = 0
+        height = 0
+        for _, depth in rbtree_walk(int(header['_M_parent']), count):
+            visited = visited + 1
+            height = max(height, depth)
+        print(f'height: {height}, minimum: {count.bit_length()}')
+        if visited != count:
+            print(f'only {visited} nodes reachable, the tree may be corrupted')
+        # The leftmost and rightmost nodes hold the key range.
+        lo = get_value_from_Rb_tree_node(header['_M_left'].cast(link).dereference())
+        hi = get_value_from_Rb_tree_node(header['_M_right'].cast(link).dereference())
+        tag = value.type.strip_typedefs().unqualified().tag or ''
+        if re.match(r'^std::(__\w+::)*(multi)?map<', tag):
+            lo, hi = lo['first'], hi['first']
+        print(f'keys: [{lo}, {hi}]')
+
+PrintMapStatsCommand()
+
+
 class PrintSyscallCommand(gdb.Command):
-    ''''''
+    '''Print syscall names and numbers'''
     def __init__(self):
         super(PrintSyscallCommand, self).__init__('psyscall', gdb.COMMAND_USER)
 
@@ -480,3 +831,4 @@ class PrintSyscallCommand(gdb.Command):
             gdb.syscalls[num] = name
 
 PrintSyscallCommand()
+
@@ -0,0 +1,87 @@
+import mmap
+import struct
+
+SHT_SYMTAB = 2
+SHT_NOTE = 7
+SHT_DYNSYM = 11
+
+STT_OBJECT = 1
+STT_FUNC = 2
+STT_GNU_IFUNC = 10
+
+SHN_UNDEF = 0
+SHN_LORESERVE = 0xff00
+
+NT_GNU_BUILD_ID = 3
+
+class Section:
+    def __init__(self, name, type, addr, offset, size, link, entsize):
+        self.name = name
+        self.type = type
+        self.addr = addr
+        self.offset = offset
+        self.size = size
+        self.link = link
+        self.entsize = entsize
+
+class ElfFile:
+    '''Minimal reader of sections and symbols of a little-endian ELF64 file'''
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        if self.data[:4] != b'\x7fELF' or self.data[4] != 2 or self.data[5] != 1:
+            self.data.close()
+            raise ValueError(f'{path}: not a little-endian ELF64 file')
+        shoff, = struct.unpack_from('<Q', self.data, 0x28)
+        shentsize, shnum, shstrndx = struct.unpack_from('<HHH', self.data, 0x3a)
+        headers = []
+        for i in range(shnum):
+            headers.append(struct.unpack_from('<IIQQQQIIQQ', self.data, shoff + i * shentsize))
+        names = headers[shstrndx][4] if shstrndx < shnum else None
+        self.sections = []
+        for name, type, _, addr, offset, size, link, _, _, entsize in headers:
+            name = self.string(names + name) if names is not None else ''
+            self.sections.append(Section(name, type, addr, offset, size, link, entsize))
+
+    def close(self):
+        self.data.close()
+
+    def string(self, offset):
+        end = self.data.find(b'\0', offset)
+        return self.data[offset:end].decode(errors = 'replace')
+
+    def section(self, name):
+        for section in self.sections:
+            if section.name == name:
+                return section
+        return None
+
+    def build_id(self):
+        for section in self.sections:
+            if section.type != SHT_NOTE:
+                continue
+            pos, end = section.offset, section.offset + section.size
+            while pos + 12 <= end:
+                namesz, descsz, type = struct.unpack_from('<III', self.data, pos)
+                name = pos + 12
+                desc = name + ((namesz + 3) & ~3)
+                if type == NT_GNU_BUILD_ID and self.data[name:name + namesz] == b'GNU\0':
+                    return self.data[desc:desc + descsz].hex()
+                pos = desc + ((descsz + 3) & ~3)
+        return None
+
+    def symbols(self):
+        '''Yield (value, size, name offset) of defined functions and objects'''
+        for section in self.sections:
+            if section.type not in (SHT_SYMTAB, SHT_DYNSYM) or section.entsize != 24:
+                continue
+            strtab = self.sections[section.link].offset
+            data = memoryview(self.data)[section.offset:section.offset + section.size]
+            for name, info, _, shndx, value, size in struct.iter_unpack('<IBBHQQ', data):
+                if value == 0 or shndx == SHN_UNDEF or shndx >= SHN_LORESERVE:
+                    continue
+                if (info & 0xf) not in (STT_FUNC, STT_OBJECT, STT_GNU_IFUNC):
+                    continue
+                yield value, size, strtab + name
+            data.release()
@@ -1,11 +1,100 @@
+import os
 import re
 import gdb
 from gdb.FrameDecorator import FrameDecorator
+import functools
 import itertools
 import rsp
 from rsp import *
 
+builtin_patterns = [
+    (r'std::__cxx11::basic_string.+?std::allocator<char> >', 'std::string'),
+    (r', std::allocator<[^<]+? >', ''),
+]
+
+# (compiled regex, replacement) of the built-in patterns and those of the config file
 patterns = []
+# The patterns as one alternation, pattern i matching group pi
+merged = None
+# Patterns applied one by one after merged, as the alternation would
+# renumber their backreferences
+ordered = []
+
+def config_path():
+    root = os.environ.get('XDG_CONFIG_HOME') or os.path.expanduser('~/.config')
+    return root + '/nebula-gdb/patterns'
+
+def load_patterns(path):
+    '''Return the (regex, replacement) pairs of a config file
+
+    Each line is `regex => replacement', the replacement may be empty and may
+    refer to groups of its regex. Empty lines and lines starting with # are
+    skipped.
+    '''
+    result = []
+    try:
+        with open(path) as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return result
+    for n, line in enumerate(lines, 1):
+        line = line.strip()
+        if len(line) == 0 or line.startswith('#'):
+            continue
+        regex, sep, repl = line.rpartition('=>')
+        regex = regex.strip()
+        try:
+            if len(sep) == 0 or len(regex) == 0:
+                raise re.error('expected `regex => replacement\'')
+            re.compile(regex)
+        except re.error as e:
+            print(f'{path}:{n}: {e}')
+            continue
+        result.append((regex, repl.strip()))
+    return result
+
+def has_backreference(regex):
+    return re.search(r'\\[1-9]|\\g<|\(\?P=', regex) is not None
+
+def compile_patterns():
+    global merged
+    del patterns[:]
+    del ordered[:]
+    for p,s in builtin_patterns + load_patterns(config_path()):
+        patterns.append((re.compile(p), s))
+    alternation = [i for i, (p, _) in enumerate(patterns) if not has_backreference(p.pattern)]
+    try:
+        merged = None
+        if len(alternation) != 0:
+            merged = re.compile('|'.join(f'(?P<p{i}>{patterns[i][0].pattern})' for i in alternation))
+    except re.error:
+        # e.g. the same group name in two patterns
+        alternation = []
+    ordered.extend(patterns[i] for i in range(len(patterns)) if i not in alternation)
+    pretty_name.cache_clear()
+
+def replace(m):
+    p, s = patterns[int(m.lastgroup[1:])]
+    # Matched again in the whole name rather than on the matched text
+    # alone, so that lookarounds, anchors and \b see the same context.
+    inner = p.match(m.string, m.start())
+    return inner.expand(s) if inner is not None else m.group()
+
+@functools.lru_cache(maxsize = 1 << 16)
+def pretty_name(name):
+    '''Shorten the verbose template arguments in a function name'''
+    # A replacement may expose another match, e.g. the allocator of a
+    # std::string, so passes repeat until nothing changes.
+    for _ in range(8):
+        shorter = name
+        if merged is not None:
+            shorter = merged.sub(replace, shorter)
+        for p,s in ordered:
+            shorter = p.sub(s, shorter)
+        if shorter == name:
+            break
+        name = shorter
+    return name
 
 class PrettyTemplateFilter():
     def __init__(self):
@@ -13,14 +102,6 @@ class PrettyTemplateFilter():
         self.enabled = True
         self.priority = 100
         gdb.frame_filters[self.name] = self
-        if len(patterns) != 0:
-            return
-        l = []
-        l.append((r'std::__cxx11::basic_string.+?std::allocator<char> >', 'std::string'))
-        l.append((r', std::allocator<[^<]+? >', ''))
-        for p,s in l:
-            patterns.append((re.compile(p), s))
-
 
     def filter(self, fi):
         fi = map(PrettyTemplateDecorator, fi)
@@ -35,12 +116,25 @@ class PrettyTemplateDecorator(FrameDecorator):
         name = str(frame.name())
         if name == 'None':
             name = '??'
-        for p,s in patterns:
-            name = re.sub(p, s, name)
+        name = pretty_name(name)
         if frame == gdb.selected_frame():
             name = '\001\033[1m\002' + name + '\001\033[0m\002'
         if frame.type() == gdb.INLINE_FRAME:
             name = name + ' [inlined]'
         return name
 
+
+class PatternsCommand(gdb.Command):
+    '''Reload and show the patterns shortening function names in backtraces'''
+    def __init__(self):
+        super(PatternsCommand, self).__init__('rsp-patterns', gdb.COMMAND_USER)
+
+    def invoke(self, args, is_tty):
+        compile_patterns()
+        print(f'user patterns: {config_path()}')
+        for p,s in patterns:
+            print(f'{p.pattern} => {s}')
+
+compile_patterns()
 PrettyTemplateFilter()
+PatternsCommand()
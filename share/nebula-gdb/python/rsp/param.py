@@ -0,0 +1,55 @@
+import sys
+import gdb
+import rsp
+
+
+class PageCacheSizeParameter(gdb.Parameter):
+    '''Set the memory budget in bytes of the rsp page cache, 0 to disable it'''
+    set_doc = 'Set the memory budget of the rsp page cache'
+    show_doc = 'Show the memory budget of the rsp page cache'
+    def __init__(self):
+        super(PageCacheSizeParameter, self).__init__('rsp-page-cache-size', gdb.COMMAND_DATA, gdb.PARAM_ZUINTEGER)
+        self.value = gdb.page_cache.budget
+
+    def get_set_string(self):
+        gdb.page_cache.resize(self.value)
+        return ''
+
+    def get_show_string(self, svalue):
+        return f'{svalue} bytes, {gdb.page_cache.used} in use'
+
+PageCacheSizeParameter()
+
+
+class MaxStrLenParameter(gdb.Parameter):
+    '''Set the maximum number of bytes scanned when probing for a string'''
+    set_doc = 'Set the maximum length of strings probed by rsp'
+    show_doc = 'Show the maximum length of strings probed by rsp'
+    def __init__(self):
+        super(MaxStrLenParameter, self).__init__('rsp-max-str-len', gdb.COMMAND_DATA, gdb.PARAM_ZUINTEGER_UNLIMITED)
+        self.value = rsp.max_str_len
+
+    def get_set_string(self):
+        rsp.max_str_len = self.value if self.value >= 0 else 1 << 62
+        return ''
+
+MaxStrLenParameter()
+
+
+class MaxElementsParameter(gdb.Parameter):
+    '''Set the maximum number of elements yielded by the libstdc++ container printers
+
+Unlimited by default, 0 follows `print elements'.'''
+    set_doc = 'Set the maximum number of elements of printed containers'
+    show_doc = 'Show the maximum number of elements of printed containers'
+    def __init__(self):
+        super(MaxElementsParameter, self).__init__('rsp-max-elements', gdb.COMMAND_DATA, gdb.PARAM_ZUINTEGER_UNLIMITED)
+        printers = sys.modules.get('libstdcxx.v6.printers')
+        self.value = printers.max_elements if printers is not None else -1
+
+    def get_set_string(self):
+        import libstdcxx.v6.printers
+        libstdcxx.v6.printers.max_elements = self.value
+        return ''
+
+MaxElementsParameter()
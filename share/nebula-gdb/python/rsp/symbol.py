@@ -0,0 +1,246 @@
+import os
+import re
+import gdb
+import mmap
+import bisect
+import struct
+from array import array
+from rsp.elf import ElfFile
+
+section_line_pattern = re.compile(r'^\s*0x([0-9a-f]+) - 0x([0-9a-f]+) is (\S+)(?: in (.+))?$')
+symbol_line_pattern = re.compile(r'^([^+]+) \+?( \d+ )?in section .* of (.*)$')
+
+class SymbolTable:
+    '''Sorted ELF symbols of one objfile, addresses are link-time addresses'''
+    magic = b'NGSYMS01'
+
+    def __init__(self, addrs, sizes, names, strtab):
+        self.addrs = addrs
+        self.sizes = sizes
+        self.names = names
+        self.strtab = strtab
+
+    @classmethod
+    def from_elf(cls, elf):
+        syms = {}
+        for value, size, name in elf.symbols():
+            if value not in syms or syms[value][0] < size:
+                syms[value] = (size, name)
+        values = sorted(syms)
+        addrs = array('Q', values)
+        sizes = array('Q', (syms[v][0] for v in values))
+        names = array('Q', (syms[v][1] for v in values))
+        return cls(addrs, sizes, names, elf.data)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        if data[:8] != cls.magic:
+            data.close()
+            raise ValueError(f'{path}: not a symbol cache')
+        n, = struct.unpack_from('<Q', data, 8)
+        columns = memoryview(data)[16:16 + 24 * n].cast('Q')
+        return cls(columns[:n], columns[n:2 * n], columns[2 * n:], data)
+
+    def save(self, path):
+        n = len(self.addrs)
+        names = array('Q')
+        blob = []
+        offset = 16 + 24 * n
+        for name in self.names:
+            s = self.strtab[name:self.strtab.find(b'\0', name) + 1]
+            names.append(offset)
+            blob.append(s)
+            offset = offset + len(s)
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        tmp = f'{path}.{os.getpid()}'
+        with open(tmp, 'wb') as f:
+            f.write(self.magic)
+            f.write(struct.pack('<Q', n))
+            f.write(array('Q', self.addrs).tobytes())
+            f.write(array('Q', self.sizes).tobytes())
+            f.write(names.tobytes())
+            f.write(b''.join(blob))
+        os.replace(tmp, path)
+
+    def __len__(self):
+        return len(self.addrs)
+
+    def find(self, addr):
+        i = bisect.bisect_right(self.addrs, addr) - 1
+        if i < 0:
+            return None
+        offset = addr - self.addrs[i]
+        if offset >= self.sizes[i] and offset != 0:
+            return None
+        name = self.names[i]
+        return self.strtab[name:self.strtab.find(b'\0', name)].decode(errors = 'replace'), offset
+
+
+def cache_path(build_id):
+    root = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(root, 'nebula-gdb', 'symbols', build_id + '.syms')
+
+def load_table(elf):
+    '''Load the symbol table of elf from the on-disk cache, building it on a miss'''
+    build_id = elf.build_id()
+    if build_id is None:
+        return SymbolTable.from_elf(elf)
+    if elf.section('.symtab') is None:
+        # Do not let a stripped file shadow the table of its debug file.
+        build_id = build_id + '-dynsym'
+    path = cache_path(build_id)
+    try:
+        return SymbolTable.load(path)
+    except:
+        pass
+    table = SymbolTable.from_elf(elf)
+    if len(table) != 0:
+        try:
+            table.save(path)
+        except:
+            pass
+    return table
+
+
+class Objfile:
+    def __init__(self, path, start, end):
+        self.path = path
+        self.start = start
+        self.end = end
+        self.sections = {}
+        self.table = None
+        self.bias = 0
+
+    def load(self):
+        if self.table is False:
+            raise ValueError(f'No symbols loaded from {self.path}')
+        if self.table is not None:
+            return self.table
+        self.table = False
+        path = self.path
+        for objfile in gdb.objfiles():
+            owner = getattr(objfile, 'owner', None)
+            if owner is not None and owner.filename == self.path:
+                path = objfile.filename
+                break
+        elf = ElfFile(path)
+        for name, addr in self.sections.items():
+            section = elf.section(name)
+            if section is not None and section.addr != 0:
+                self.bias = addr - section.addr
+                if name == '.text':
+                    break
+        table = load_table(elf)
+        if len(table) == 0:
+            raise ValueError(f'No symbols found in {path}')
+        self.table = table
+        return self.table
+
+    def find(self, addr):
+        return self.load().find(addr - self.bias)
+
+
+class Symbolizer:
+    '''Resolve addresses to <symbol+offset> with per-objfile sorted symbol tables'''
+    def __init__(self):
+        self.memo = {}
+        self.demangled = {}
+        self.objfiles = []
+        self.starts = []
+        self.load_objfiles()
+
+    def load_objfiles(self):
+        objfiles = {}
+        main = gdb.current_progspace().filename
+        out = gdb.execute('info files', to_string = True)
+        for line in out.splitlines():
+            match = section_line_pattern.match(line)
+            if not match:
+                continue
+            b, e, name, path = match.groups()
+            if path is None:
+                if not name.startswith('.') or main is None:
+                    continue
+                path = main
+            b, e = int(b, 16), int(e, 16)
+            objfile = objfiles.get(path)
+            if objfile is None:
+                objfile = objfiles[path] = Objfile(path, b, e)
+            objfile.start = min(objfile.start, b)
+            objfile.end = max(objfile.end, e)
+            objfile.sections.setdefault(name, b)
+        self.objfiles = sorted(objfiles.values(), key = lambda o: o.start)
+        self.starts = [o.start for o in self.objfiles]
+
+    def demangle(self, name):
+        if not name.startswith('_Z'):
+            return name
+        result = self.demangled.get(name)
+        if result is None:
+            try:
+                result = gdb.execute('demangle -l c++ -- ' + name, to_string = True).strip()
+            except:
+                result = name
+            self.demangled[name] = result
+        return result
+
+    def lookup_objfile(self, addr):
+        i = bisect.bisect_right(self.starts, addr) - 1
+        if i < 0 or addr >= self.objfiles[i].end:
+            return None
+        return self.objfiles[i]
+
+    def info_symbol(self, addr):
+        out = gdb.execute('info symbol 0x%x' % addr, to_string = True)[:-1]
+        if 'No symbol' in out:
+            return None
+        match = symbol_line_pattern.match(out)
+        if not match:
+            return None
+        offset = match.group(2)
+        return match.group(1), 0 if offset is None else int(offset)
+
+    def lookup(self, addr):
+        if addr in self.memo:
+            return self.memo[addr]
+        result = None
+        objfile = self.lookup_objfile(addr)
+        if objfile is None:
+            # Stack and heap pointers, no symbol to find.
+            self.memo[addr] = None
+            return None
+        try:
+            result = objfile.find(addr)
+            if result is not None:
+                result = self.demangle(result[0]), result[1]
+        except:
+            result = self.info_symbol(addr)
+        self.memo[addr] = result
+        return result
+
+    def lookup_all(self, addrs):
+        return [self.lookup(addr) for addr in addrs]
+
+
+def reset(*args):
+    gdb.symbolizer = None
+
+def symbolizer():
+    if getattr(gdb, 'symbolizer', None) is None:
+        gdb.symbolizer = Symbolizer()
+    return gdb.symbolizer
+
+def symbolize(addrs):
+    '''Return (name, offset) or None for each of addrs'''
+    return symbolizer().lookup_all(addrs)
+
+
+if hasattr(gdb, 'symbolizer_reset'):
+    gdb.events.new_objfile.disconnect(gdb.symbolizer_reset)
+    gdb.events.clear_objfiles.disconnect(gdb.symbolizer_reset)
+gdb.symbolizer_reset = reset
+gdb.events.new_objfile.connect(reset)
+gdb.events.clear_objfiles.connect(reset)
+reset()
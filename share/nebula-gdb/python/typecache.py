@@ -0,0 +1,66 @@
+import gdb
+
+# progspace -> {key: result}, results of failed lookups are stored as the error
+caches = {}
+
+def invalidate(ev):
+    progspace = getattr(ev, 'progspace', None)
+    if progspace is None and hasattr(ev, 'new_objfile'):
+        progspace = ev.new_objfile.progspace
+    if progspace is None:
+        caches.clear()
+    else:
+        caches.pop(progspace, None)
+
+def cached(key, compute):
+    '''Return compute() memoized by key in the cache of the current progspace'''
+    cache = caches.get(gdb.current_progspace())
+    if cache is None:
+        cache = caches[gdb.current_progspace()] = {}
+    try:
+        result = cache[key]
+    except KeyError:
+        try:
+            result = compute()
+        except Exception as e:
+            result = e
+        cache[key] = result
+    if isinstance(result, Exception):
+        raise type(result)(*result.args)
+    return result
+
+def lookup_type(name):
+    '''gdb.lookup_type, memoized per progspace'''
+    return cached(name, lambda: gdb.lookup_type(name))
+
+def is_unsigned(type):
+    try:
+        return not type.is_signed
+    except:
+        pass
+    if type.code == gdb.TYPE_CODE_ENUM:
+        return all(f.enumval >= 0 for f in type.fields())
+    name = type.name or ''
+    return name.startswith('unsigned') or name.startswith('u') or name == 'bool'
+
+def scalar_format(type):
+    '''Return the struct format of a scalar gdb.Type, or None'''
+    type = type.strip_typedefs()
+    if type.code == gdb.TYPE_CODE_BOOL and type.sizeof == 1:
+        return '?'
+    if type.code == gdb.TYPE_CODE_FLT:
+        return {4: 'f', 8: 'd'}.get(type.sizeof)
+    if type.code in (gdb.TYPE_CODE_INT, gdb.TYPE_CODE_ENUM, gdb.TYPE_CODE_CHAR):
+        fmt = {1: 'b', 2: 'h', 4: 'i', 8: 'q'}.get(type.sizeof)
+        if fmt is not None and is_unsigned(type):
+            fmt = fmt.upper()
+        return fmt
+    return None
+
+
+if hasattr(gdb, 'typecache_invalidate'):
+    gdb.events.new_objfile.disconnect(gdb.typecache_invalidate)
+    gdb.events.clear_objfiles.disconnect(gdb.typecache_invalidate)
+gdb.typecache_invalidate = invalidate
+gdb.events.new_objfile.connect(invalidate)
+gdb.events.clear_objfiles.connect(invalidate)